@@ -0,0 +1,92 @@
+"""
+CLI startup benchmark.
+
+Runs `python -X importtime -c "import nullshare.cli"` a few times, reports
+the cumulative import time and the slowest modules, and fails if startup
+goes over budget or pulls in a module only some commands need. Then times
+scripted `nullshare status` and `nullshare --help` runs end to end.
+
+    python benchmarks/import_time.py [--runs N] [--budget-ms MS]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Modules that must stay out of a bare CLI startup
+HEAVY_MODULES = (
+    'flask', 'werkzeug', 'jinja2', 'PIL', 'qrcode', 'netifaces', 'requests', 'asyncio',
+    'zstandard', 'tarfile'
+)
+
+# A port nothing listens on, so 'status' fails fast
+IDLE_PORT = 9
+
+
+def import_profile(module: str):
+    """Import module in a fresh interpreter; return {name: (self_us, cumulative_us)}."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True, cwd=ROOT, env=dict(os.environ, PYTHONPATH=str(ROOT)),
+        check=True
+    )
+    profile = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        profile[name.strip()] = (int(self_us), int(cumulative_us))
+    return profile
+
+
+def time_command(args, runs: int) -> float:
+    """Median wall time of a CLI invocation, in milliseconds."""
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, '-m', 'nullshare', *args], capture_output=True,
+                       cwd=ROOT, env=dict(os.environ, PYTHONPATH=str(ROOT)))
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='Runs per measurement')
+    parser.add_argument('--budget-ms', type=float, default=100.0,
+                        help='Fail if importing nullshare.cli takes longer than this')
+    parser.add_argument('--top', type=int, default=10, help='Slowest modules to list')
+    args = parser.parse_args()
+
+    profiles = [import_profile('nullshare.cli') for _ in range(args.runs)]
+    totals = [profile['nullshare.cli'][1] / 1000 for profile in profiles]
+    median_ms = statistics.median(totals)
+    print(f"import nullshare.cli: median {median_ms:.1f} ms, best {min(totals):.1f} ms over {args.runs} runs")
+
+    fastest = profiles[totals.index(min(totals))]
+    print(f"\nSlowest modules by self time:")
+    for name, (self_us, cumulative_us) in sorted(fastest.items(), key=lambda item: -item[1][0])[:args.top]:
+        print(f"  {self_us / 1000:7.1f} ms  {cumulative_us / 1000:7.1f} ms cumulative  {name}")
+
+    for command in (['status', '--port', str(IDLE_PORT)], ['--help']):
+        print(f"\nnullshare {' '.join(command)}: {time_command(command, args.runs):.1f} ms wall time")
+
+    failed = False
+    loaded = {name.split('.')[0] for name in fastest}
+    heavy = sorted(loaded.intersection(HEAVY_MODULES))
+    if heavy:
+        print(f"\nFAIL: CLI startup imports {', '.join(heavy)}")
+        failed = True
+    if median_ms > args.budget_ms:
+        print(f"\nFAIL: CLI import takes {median_ms:.1f} ms, budget is {args.budget_ms:.0f} ms")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,110 @@
+"""
+NullShare transfer admission control
+"""
+import math
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Optional
+
+# Bounds of the Retry-After hint given to clients that are turned away
+MIN_RETRY_AFTER = 1
+MAX_RETRY_AFTER = 120
+
+
+class ServerBusy(Exception):
+    """No transfer slot became free in time."""
+
+    def __init__(self, position: int, retry_after: int):
+        super().__init__(f"Server busy, number {position} in the queue")
+        self.position = position
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Caps the number of simultaneous transfers.
+
+    Requests beyond max_active wait in a FIFO queue of at most max_queue
+    entries for up to max_wait seconds. Few transfers reading at a time keep
+    disk access close to sequential, which matters far more for aggregate
+    throughput on spinning disks than serving everyone at once. Waiting
+    blocks the calling thread, so with a fixed pool of threads the queue
+    must be small enough to leave threads for other requests.
+    """
+
+    def __init__(self, max_active: int, max_queue: int = 64, max_wait: float = 30.0):
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._cond = threading.Condition()
+        self._active = 0
+        self._queue: Deque[object] = deque()
+        # Moving average of how long a transfer holds its slot
+        self._hold: Optional[float] = None
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def waiting(self) -> int:
+        return len(self._queue)
+
+    def _retry_after(self, position: int) -> int:
+        hold = self._hold if self._hold is not None else 5.0
+        estimate = math.ceil(position * hold / self.max_active)
+        return max(MIN_RETRY_AFTER, min(MAX_RETRY_AFTER, estimate))
+
+    def acquire(self) -> Callable[[], None]:
+        """
+        Wait for a transfer slot.
+
+        Returns:
+            Function that gives the slot back; calling it again does nothing
+
+        Raises:
+            ServerBusy: If the queue is full or no slot freed up in time
+        """
+        with self._cond:
+            if self._active < self.max_active and not self._queue:
+                return self._grant()
+            if len(self._queue) >= self.max_queue:
+                position = len(self._queue) + 1
+                raise ServerBusy(position, self._retry_after(position))
+
+            ticket = object()
+            self._queue.append(ticket)
+            deadline = time.monotonic() + self.max_wait
+            try:
+                while self._queue[0] is not ticket or self._active >= self.max_active:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        position = self._queue.index(ticket) + 1
+                        raise ServerBusy(position, self._retry_after(position))
+                    self._cond.wait(remaining)
+                self._queue.popleft()
+                return self._grant()
+            finally:
+                if ticket in self._queue:
+                    self._queue.remove(ticket)
+                # Whoever is at the head now may be able to go
+                self._cond.notify_all()
+
+    def _grant(self) -> Callable[[], None]:
+        """Take a slot. Caller holds the condition."""
+        self._active += 1
+        started = time.monotonic()
+        released = False
+
+        def release():
+            nonlocal released
+            with self._cond:
+                if released:
+                    return
+                released = True
+                self._active -= 1
+                hold = time.monotonic() - started
+                self._hold = hold if self._hold is None else 0.8 * self._hold + 0.2 * hold
+                self._cond.notify_all()
+        return release
@@ -0,0 +1,638 @@
+"""
+NullShare folder archive streaming
+"""
+import hashlib
+import os
+import stat
+import struct
+import sys
+import tarfile
+import time
+import zlib
+from collections import deque
+from pathlib import Path
+from typing import TYPE_CHECKING, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    # concurrent.futures pulls in logging; the CLI imports this module at startup
+    from concurrent.futures import Executor
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Size of the reads from disk and of the chunks handed to the HTTP layer
+CHUNK_SIZE = 64 * 1024
+
+# Members are deflated in blocks of this size, independently of the number
+# of workers, so the same folder always gives the same bytes
+BLOCK_SIZE = 128 * 1024
+_DEFLATE_WINDOW = 32 * 1024
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+
+# Folder archive formats: name -> (file suffix, MIME type)
+ARCHIVE_FORMATS: Dict[str, Tuple[str, str]] = {
+    'zip': ('.zip', 'application/zip'),
+    'tar': ('.tar', 'application/x-tar'),
+    'tar.zst': ('.tar.zst', 'application/zstd'),
+}
+ZSTD_LEVEL = 3
+
+_TAR_BLOCK = tarfile.BLOCKSIZE
+_TAR_RECORD = tarfile.RECORDSIZE
+
+# Formats that are already compressed; deflating them only burns CPU
+STORED_EXTENSIONS = frozenset({
+    # Images
+    'jpg', 'jpeg', 'png', 'gif', 'webp', 'heic', 'heif', 'avif', 'jxl',
+    # Audio and video
+    'mp3', 'aac', 'm4a', 'ogg', 'opus', 'flac', 'mp4', 'm4v', 'mkv', 'mov',
+    'avi', 'webm', 'wmv',
+    # Archives and packages
+    'zip', 'gz', 'tgz', 'bz2', 'xz', 'txz', 'zst', 'lz4', 'lzma', '7z', 'rar',
+    'apk', 'aab', 'ipa', 'jar', 'whl', 'deb', 'rpm', 'dmg', 'cab', 'msi',
+    # Documents that are zip containers
+    'docx', 'xlsx', 'pptx', 'odt', 'ods', 'odp', 'epub',
+    # Fonts
+    'woff', 'woff2',
+})
+
+_ZIP64_LIMIT = (1 << 31) - 1
+_ZIP_MAX = 0xFFFFFFFF
+_ZIP_FILECOUNT_LIMIT = 0xFFFF
+
+_LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')
+_CENTRAL_DIR = struct.Struct('<4s4B4HL2L5H2L')
+_END_ARCHIVE = struct.Struct('<4s4H2LH')
+_END_ARCHIVE64 = struct.Struct('<4sQ2H2L4Q')
+_END_ARCHIVE64_LOCATOR = struct.Struct('<4sLQL')
+
+_SIG_LOCAL = b'PK\003\004'
+_SIG_CENTRAL = b'PK\001\002'
+_SIG_END = b'PK\005\006'
+_SIG_END64 = b'PK\006\006'
+_SIG_END64_LOCATOR = b'PK\006\007'
+_SIG_DATA_DESCRIPTOR = 0x08074b50
+
+_FLAG_DATA_DESCRIPTOR = 0x08
+_FLAG_UTF8 = 0x800
+
+_DEFAULT_VERSION = 20
+_ZIP64_VERSION = 45
+_CREATE_SYSTEM = 0 if sys.platform == 'win32' else 3
+
+
+# (path, arcname, size, mtime_ns) of a file to archive, as it was listed
+ArchiveFile = Tuple[Path, str, int, int]
+
+
+class ArchiveChanged(Exception):
+    """A member no longer matches the size and time it was listed with."""
+
+
+def iter_folder_files(folder: Path) -> Iterator[ArchiveFile]:
+    """
+    Yield (path, arcname, size, mtime_ns) for every regular file below folder.
+
+    Directories are walked lazily and in sorted order, so the first entry is
+    available immediately and the same tree always yields the same sequence.
+    """
+    for root, dirnames, filenames in os.walk(folder):
+        dirnames.sort()
+        for name in sorted(filenames):
+            path = Path(root) / name
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if stat.S_ISREG(st.st_mode):
+                yield path, path.relative_to(folder).as_posix(), st.st_size, st.st_mtime_ns
+
+
+def _check_member(src, arcname: str, size: int, mtime_ns: int) -> os.stat_result:
+    st = os.fstat(src.fileno())
+    if st.st_size != size or st.st_mtime_ns != mtime_ns:
+        raise ArchiveChanged(f"'{arcname}' changed since the folder was listed")
+    return st
+
+
+def _open_member(path: Path, arcname: str, size: int, mtime_ns: int):
+    """
+    Open a member, checking it still is what the archive was planned from.
+
+    Archive lengths and ETags come from the listing, so a member that
+    changed or vanished cannot be sent without breaking them.
+
+    Returns:
+        The open file and its stat result
+
+    Raises:
+        ArchiveChanged: If the file is gone or its size or time differ
+    """
+    try:
+        src = open(path, 'rb')
+    except OSError as e:
+        raise ArchiveChanged(f"'{arcname}' vanished since the folder was listed") from e
+    try:
+        return src, _check_member(src, arcname, size, mtime_ns)
+    except BaseException:
+        src.close()
+        raise
+
+
+def _read_member(src, arcname: str, size: int, block_size: int) -> Iterator[bytes]:
+    """Yield exactly size bytes of a member in blocks of block_size."""
+    remaining = size
+    while remaining > 0:
+        data = src.read(min(block_size, remaining))
+        if not data:
+            raise ArchiveChanged(f"'{arcname}' shrank while it was read")
+        remaining -= len(data)
+        yield data
+
+
+class CompressionPolicy:
+    """
+    Decides per member whether to deflate it or store it as is.
+
+    A member is stored when deflating is switched off (level 0), when it is
+    smaller than min_size, when its extension names an already compressed
+    format, or when a fast trial compression of its first block saves less
+    than min_saving. Everything else is deflated at the given level. The
+    decision only depends on the file's name, size and first block, so the
+    same folder still gives the same archive.
+    """
+
+    def __init__(self, level: int = 6, min_size: int = 256,
+                 min_saving: float = 0.05, sample_size: int = 16 * 1024,
+                 stored_extensions: Iterable[str] = STORED_EXTENSIONS):
+        if not 0 <= level <= 9:
+            raise ValueError(f"Compression level must be between 0 and 9, got {level}")
+        self.level = level
+        self.min_size = min_size
+        self.min_saving = min_saving
+        self.sample_size = sample_size
+        self.stored_extensions = frozenset(ext.lower() for ext in stored_extensions)
+
+    @property
+    def stores_all(self) -> bool:
+        """True if no member is ever deflated."""
+        return self.level == 0
+
+    @property
+    def key(self) -> str:
+        """Identifies the settings in archive ETags."""
+        extensions = hashlib.sha1(','.join(sorted(self.stored_extensions)).encode('utf-8'))
+        return (f'{self.level}:{self.min_size}:{self.min_saving}:{self.sample_size}:'
+                f'{extensions.hexdigest()[:12]}')
+
+    def choose(self, arcname: str, size: int, head: bytes) -> int:
+        """Return ZIP_STORED or ZIP_DEFLATED for a member starting with head."""
+        if self.stores_all or size < self.min_size:
+            return ZIP_STORED
+        _, dot, extension = arcname.rpartition('/')[2].rpartition('.')
+        if dot and extension.lower() in self.stored_extensions:
+            return ZIP_STORED
+        sample = head[:self.sample_size]
+        if sample and len(zlib.compress(sample, 1)) > len(sample) * (1 - self.min_saving):
+            # Looks random: encrypted, compressed or media without a known extension
+            return ZIP_STORED
+        return ZIP_DEFLATED
+
+
+def available_formats() -> List[str]:
+    """Archive formats that can be built with the installed modules."""
+    return [name for name in ARCHIVE_FORMATS if name != 'tar.zst' or zstandard is not None]
+
+
+def archive_etag(fingerprint: str, policy: Optional[CompressionPolicy] = None,
+                 archive_format: str = 'zip') -> str:
+    """
+    Strong ETag for the archive built from a folder snapshot.
+
+    Archives are built deterministically, so a fingerprint of the member
+    names, sizes and modification times, together with the format and its
+    compression settings, is enough to identify the bytes.
+    """
+    if archive_format == 'zip':
+        settings = (policy or CompressionPolicy()).key
+    elif archive_format == 'tar.zst':
+        # iter_zstd() always runs multi-threaded; the library version is
+        # included because the encoder's output may change between releases
+        version = '.'.join(map(str, zstandard.ZSTD_VERSION)) if zstandard is not None else ''
+        settings = f'{ZSTD_LEVEL}:mt:{version}'
+    else:
+        settings = ''
+    digest = hashlib.sha1(f'{archive_format}:{settings}:{fingerprint}'.encode('ascii'))
+    return f'"{digest.hexdigest()}"'
+
+
+def _encode_arcname(arcname: str) -> Tuple[bytes, int]:
+    """Encode a member name, returning it with the flag bits it needs."""
+    try:
+        return arcname.encode('ascii'), _FLAG_DATA_DESCRIPTOR
+    except UnicodeEncodeError:
+        return arcname.encode('utf-8', 'surrogateescape'), _FLAG_DATA_DESCRIPTOR | _FLAG_UTF8
+
+
+def _needs_zip64(size: int) -> bool:
+    # Same heuristic as zipfile: leave headroom for incompressible data
+    return size * 1.05 > _ZIP64_LIMIT
+
+
+def stored_zip_length(members: Iterable[Tuple[str, int, int]]) -> int:
+    """
+    Exact length of the archive iter_zip builds when every member is stored.
+
+    Args:
+        members: (arcname, size, mtime_ns) of every member, in archive order
+
+    Without compression the archive layout only depends on the names and
+    sizes, so its length is known before a single byte has been read.
+    """
+    offset = 0
+    size_dir = 0
+    count = 0
+    for arcname, size, _ in members:
+        name_length = len(_encode_arcname(arcname)[0])
+        zip64 = _needs_zip64(size)
+        header_offset = offset
+        offset += _LOCAL_HEADER.size + name_length + (20 if zip64 else 0)
+        offset += size + (24 if zip64 else 16)
+        # Sizes and offsets that overflow move to the zip64 extra field
+        extra_fields = 2 * (size > _ZIP64_LIMIT) + (header_offset > _ZIP64_LIMIT)
+        size_dir += _CENTRAL_DIR.size + name_length + (4 + 8 * extra_fields if extra_fields else 0)
+        count += 1
+
+    length = offset + size_dir + _END_ARCHIVE.size
+    if count >= _ZIP_FILECOUNT_LIMIT or offset > _ZIP64_LIMIT or size_dir > _ZIP64_LIMIT:
+        length += _END_ARCHIVE64.size + _END_ARCHIVE64_LOCATOR.size
+    return length
+
+
+class _ZipEntry:
+    """Central directory bookkeeping for one archive member."""
+
+    __slots__ = ('filename', 'flag_bits', 'compress_type', 'dostime', 'dosdate',
+                 'crc', 'compress_size', 'file_size', 'external_attr',
+                 'header_offset', 'extract_version')
+
+    def __init__(self, filename: bytes, flag_bits: int, compress_type: int,
+                 date_time: Tuple[int, ...], external_attr: int, header_offset: int):
+        self.filename = filename
+        self.flag_bits = flag_bits
+        self.compress_type = compress_type
+        self.dosdate = (date_time[0] - 1980) << 9 | date_time[1] << 5 | date_time[2]
+        self.dostime = date_time[3] << 11 | date_time[4] << 5 | (date_time[5] // 2)
+        self.external_attr = external_attr
+        self.header_offset = header_offset
+        self.extract_version = _DEFAULT_VERSION
+        self.crc = 0
+        self.compress_size = 0
+        self.file_size = 0
+
+
+class _Done:
+    """Already computed result, standing in for a Future."""
+
+    __slots__ = ('value',)
+
+    def __init__(self, value: bytes):
+        self.value = value
+
+    def result(self) -> bytes:
+        return self.value
+
+    def cancel(self) -> bool:
+        return False
+
+
+def _deflate_block(data: bytes, zdict: bytes, last: bool, level: int = 6) -> bytes:
+    """
+    Raw-deflate one block of a member.
+
+    Every block but the last ends with a sync flush on a byte boundary, so
+    independently compressed blocks concatenate into one valid stream. The
+    previous block's tail is the dictionary, which keeps the ratio close to
+    compressing the whole file in one go.
+    """
+    if zdict:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=zdict)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+class ZipStream:
+    """
+    Write a ZIP archive as a sequence of byte chunks.
+
+    Files are read sequentially and, where the compression policy says so,
+    deflated in fixed-size blocks. With an
+    executor the blocks are compressed in parallel (zlib releases the GIL)
+    while a bounded window of them is in flight, and written out in order.
+    The output does not depend on the number of workers, so an archive is
+    reproducible byte for byte. Sizes and CRCs go in data descriptors after
+    each member, which is what lets the archive be produced without seeking.
+    """
+
+    def __init__(self, policy: Optional[CompressionPolicy] = None, chunk_size: int = CHUNK_SIZE,
+                 executor: Optional['Executor'] = None, window: int = 16):
+        self.policy = policy or CompressionPolicy()
+        self.chunk_size = chunk_size
+        self.executor = executor
+        self.window = window if executor else 0
+        self.offset = 0
+        self._entries: List[_ZipEntry] = []
+
+    def _new_entry(self, st: os.stat_result, arcname: str,
+                   compression: int) -> Tuple[_ZipEntry, bytes, bool]:
+        date_time = time.localtime(st.st_mtime)[:6]
+        if date_time[0] < 1980:
+            date_time = (1980, 1, 1, 0, 0, 0)
+
+        filename, flag_bits = _encode_arcname(arcname)
+        entry = _ZipEntry(filename, flag_bits, compression, date_time,
+                          (st.st_mode & 0xFFFF) << 16, 0)
+        zip64 = _needs_zip64(st.st_size)
+        extra = b''
+        if zip64:
+            extra = struct.pack('<HHQQ', 1, 16, 0, 0)
+            entry.extract_version = _ZIP64_VERSION
+
+        header = _LOCAL_HEADER.pack(
+            _SIG_LOCAL, entry.extract_version, 0, flag_bits, entry.compress_type,
+            entry.dostime, entry.dosdate, 0,
+            _ZIP_MAX if zip64 else 0, _ZIP_MAX if zip64 else 0,
+            len(filename), len(extra)) + filename + extra
+        return entry, header, zip64
+
+    def _submit(self, data: bytes, zdict: bytes, last: bool):
+        if self.executor:
+            return self.executor.submit(_deflate_block, data, zdict, last, self.policy.level)
+        return _Done(_deflate_block(data, zdict, last, self.policy.level))
+
+    def _iter_items(self, files: Iterable[ArchiveFile]) -> Iterator[tuple]:
+        """
+        Read members in order, producing header, data and end items.
+
+        Members are written with their listed size. One that changed since
+        it was listed raises ArchiveChanged, since the archive would no
+        longer match the length and ETag it is sent with.
+        """
+        for path, arcname, size, mtime_ns in files:
+            src, st = _open_member(path, arcname, size, mtime_ns)
+            with src:
+                blocks = _read_member(src, arcname, size, BLOCK_SIZE)
+                # The first block is needed before the header to pick the method
+                block = next(blocks, b'')
+                compression = self.policy.choose(arcname, size, block)
+                entry, header, zip64 = self._new_entry(st, arcname, compression)
+                self._entries.append(entry)
+                yield 'header', entry, header
+
+                crc = 0
+                file_size = 0
+                if compression == ZIP_DEFLATED:
+                    zdict = b''
+                    while True:
+                        crc = zlib.crc32(block, crc)
+                        file_size += len(block)
+                        following = next(blocks, b'')
+                        last = not following
+                        yield 'data', entry, self._submit(block, zdict, last)
+                        if last:
+                            break
+                        zdict = block[-_DEFLATE_WINDOW:]
+                        block = following
+                else:
+                    while block:
+                        crc = zlib.crc32(block, crc)
+                        file_size += len(block)
+                        yield 'data', entry, _Done(block)
+                        block = next(blocks, b'')
+                _check_member(src, arcname, size, mtime_ns)
+
+                entry.crc = crc
+                entry.file_size = file_size
+                yield 'end', entry, zip64
+
+    def _resolve(self, item: tuple) -> bytes:
+        """Turn the next item into output bytes, waiting for its block if needed."""
+        kind, entry, value = item
+        if kind == 'header':
+            entry.header_offset = self.offset
+            data = value
+        elif kind == 'data':
+            data = value.result()
+            entry.compress_size += len(data)
+        else:
+            fmt = '<LLQQ' if value else '<LLLL'
+            data = struct.pack(fmt, _SIG_DATA_DESCRIPTOR, entry.crc,
+                               entry.compress_size, entry.file_size)
+        self.offset += len(data)
+        return data
+
+    def _iter_resolved(self, files: Iterable[ArchiveFile]) -> Iterator[bytes]:
+        pending: Deque[tuple] = deque()
+        items = self._iter_items(files)
+        try:
+            for item in items:
+                pending.append(item)
+                while len(pending) > self.window:
+                    yield self._resolve(pending.popleft())
+            while pending:
+                yield self._resolve(pending.popleft())
+        finally:
+            items.close()
+            for kind, _, value in pending:
+                if kind == 'data':
+                    value.cancel()
+
+    def iter_members(self, files: Iterable[ArchiveFile]) -> Iterator[bytes]:
+        """Yield the local header, data and data descriptor of every file."""
+        out: List[bytes] = []
+        out_size = 0
+        for data in self._iter_resolved(files):
+            out.append(data)
+            out_size += len(data)
+            if out_size >= self.chunk_size:
+                yield b''.join(out)
+                out = []
+                out_size = 0
+        if out:
+            yield b''.join(out)
+
+    def finish(self) -> bytes:
+        """Return the central directory and end records."""
+        start_dir = self.offset
+        records = []
+        for entry in self._entries:
+            extra_fields = []
+            file_size = entry.file_size
+            compress_size = entry.compress_size
+            header_offset = entry.header_offset
+            if file_size > _ZIP64_LIMIT:
+                extra_fields.append(file_size)
+                file_size = _ZIP_MAX
+            if compress_size > _ZIP64_LIMIT:
+                extra_fields.append(compress_size)
+                compress_size = _ZIP_MAX
+            if header_offset > _ZIP64_LIMIT:
+                extra_fields.append(header_offset)
+                header_offset = _ZIP_MAX
+
+            extra = b''
+            extract_version = entry.extract_version
+            if extra_fields:
+                extra = struct.pack('<HH' + 'Q' * len(extra_fields),
+                                    1, 8 * len(extra_fields), *extra_fields)
+                extract_version = _ZIP64_VERSION
+
+            records.append(_CENTRAL_DIR.pack(
+                _SIG_CENTRAL, extract_version, _CREATE_SYSTEM, extract_version, 0,
+                entry.flag_bits, entry.compress_type, entry.dostime, entry.dosdate,
+                entry.crc, compress_size, file_size,
+                len(entry.filename), len(extra), 0, 0, 0,
+                entry.external_attr, header_offset) + entry.filename + extra)
+
+        central_dir = b''.join(records)
+        count = len(self._entries)
+        size_dir = len(central_dir)
+        end = b''
+        if count >= _ZIP_FILECOUNT_LIMIT or start_dir > _ZIP64_LIMIT or size_dir > _ZIP64_LIMIT:
+            end += _END_ARCHIVE64.pack(
+                _SIG_END64, 44, _ZIP64_VERSION, _ZIP64_VERSION, 0, 0,
+                count, count, size_dir, start_dir)
+            end += _END_ARCHIVE64_LOCATOR.pack(
+                _SIG_END64_LOCATOR, 0, start_dir + size_dir, 1)
+            count = min(count, _ZIP_FILECOUNT_LIMIT)
+            size_dir = min(size_dir, _ZIP_MAX)
+            start_dir = min(start_dir, _ZIP_MAX)
+        end += _END_ARCHIVE.pack(_SIG_END, 0, 0, count, count, size_dir, start_dir, 0)
+        data = central_dir + end
+        self.offset += len(data)
+        return data
+
+
+def iter_zip(folder: Path, policy: Optional[CompressionPolicy] = None, chunk_size: int = CHUNK_SIZE,
+             files: Optional[Iterable[ArchiveFile]] = None,
+             executor: Optional['Executor'] = None, window: int = 16) -> Iterator[bytes]:
+    """
+    Stream a folder as a ZIP archive.
+
+    Args:
+        folder: Folder to archive, member names are relative to it
+        policy: Chooses the compression of each member, deflate by default
+        chunk_size: Approximate size of the yielded chunks
+        files: (path, arcname, size, mtime_ns) of the members, as listed,
+            to use instead of walking the folder
+        executor: Pool to deflate blocks on; compress inline if None
+        window: Blocks that may be in flight on the executor at once
+
+    Yields:
+        Consecutive pieces of the archive
+    """
+    if files is None:
+        files = iter_folder_files(folder)
+    stream = ZipStream(policy=policy, chunk_size=chunk_size,
+                       executor=executor, window=window)
+    for chunk in stream.iter_members(files):
+        yield chunk
+    yield stream.finish()
+
+
+def _tar_header(arcname: str, size: int, mtime: int, mode: int) -> bytes:
+    info = tarfile.TarInfo(arcname)
+    info.size = size
+    info.mtime = mtime
+    info.mode = mode & 0o7777
+    # Owner fields stay empty, so the archive does not depend on who shares it
+    return info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+
+
+def _tar_padding(size: int, block: int) -> int:
+    return -size % block
+
+
+def iter_tar(folder: Path, chunk_size: int = CHUNK_SIZE,
+             files: Optional[Iterable[ArchiveFile]] = None) -> Iterator[bytes]:
+    """
+    Stream a folder as an uncompressed POSIX (pax) tar archive.
+
+    Tar needs no per-member bookkeeping, so this runs at disk speed. Every
+    member is written with the size it was listed with, so the archive is
+    exactly tar_length() long. A member that changed or vanished since
+    raises ArchiveChanged instead of producing a body out of step with that
+    length.
+
+    Args:
+        folder: Folder to archive, member names are relative to it
+        chunk_size: Size of the reads from disk
+        files: (path, arcname, size, mtime_ns) of the members to use instead
+            of walking the folder
+
+    Yields:
+        Consecutive pieces of the archive
+    """
+    if files is None:
+        files = iter_folder_files(folder)
+    total = 0
+    for path, arcname, size, mtime_ns in files:
+        src, st = _open_member(path, arcname, size, mtime_ns)
+        with src:
+            pending = _tar_header(arcname, size, mtime_ns // 1_000_000_000, st.st_mode)
+            total += len(pending)
+            for data in _read_member(src, arcname, size, chunk_size):
+                total += len(data)
+                yield pending + data if pending else data
+                pending = b''
+            _check_member(src, arcname, size, mtime_ns)
+            padding = bytes(_tar_padding(size, _TAR_BLOCK))
+            total += len(padding)
+            if pending or padding:
+                yield pending + padding
+
+    end = 2 * _TAR_BLOCK
+    yield bytes(end + _tar_padding(total + end, _TAR_RECORD))
+
+
+def tar_length(members: Iterable[Tuple[str, int, int]]) -> int:
+    """
+    Exact length of the archive iter_tar builds.
+
+    Args:
+        members: (arcname, size, mtime_ns) of every member, in archive order
+    """
+    total = 0
+    for arcname, size, mtime_ns in members:
+        total += len(_tar_header(arcname, size, mtime_ns // 1_000_000_000, 0o644))
+        total += size + _tar_padding(size, _TAR_BLOCK)
+    end = 2 * _TAR_BLOCK
+    return total + end + _tar_padding(total + end, _TAR_RECORD)
+
+
+def iter_zstd(chunks: Iterable[bytes], level: int = ZSTD_LEVEL, threads: int = 1) -> Iterator[bytes]:
+    """
+    Compress a byte stream into a single zstd frame.
+
+    Always compresses in zstd's multi-threaded mode. Its output does not
+    depend on the worker count, but differs from single-threaded output,
+    so sticking to one mode keeps the bytes matching archive_etag().
+
+    Args:
+        chunks: Data to compress
+        level: zstd compression level
+        threads: zstd worker threads, at least 1
+    """
+    if zstandard is None:
+        raise RuntimeError("zstandard is not installed. Install it with: pip install zstandard")
+    compressor = zstandard.ZstdCompressor(level=level, threads=max(1, threads)).compressobj()
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
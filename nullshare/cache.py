@@ -0,0 +1,162 @@
+"""
+NullShare on-disk archive cache
+"""
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Iterable, Iterator, Optional, Set
+
+
+class ArchiveCache:
+    """
+    Built folder archives kept as plain files in a temporary directory.
+
+    Entries are keyed by the archive ETag, which already covers the names,
+    sizes and modification times of the members, the format and its
+    compression settings, so a changed folder simply misses. Archives are recorded while
+    they are streamed to a client and only kept once complete. When the
+    total size goes over max_bytes the least recently used archives are
+    deleted.
+    """
+
+    def __init__(self, max_bytes: int, directory: Optional[Path] = None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.size = 0
+        self._owns_directory = directory is None
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[str, int]' = OrderedDict()
+        self._building: Set[str] = set()
+
+    @staticmethod
+    def _name(etag: str) -> str:
+        return etag.strip('"').replace('/', '_')
+
+    def _path(self, etag: str) -> Path:
+        return self.directory / f'{self._name(etag)}.archive'
+
+    def _ensure_directory(self) -> Path:
+        if self.directory is None:
+            self.directory = Path(tempfile.mkdtemp(prefix='nullshare-archives-'))
+        else:
+            self.directory.mkdir(parents=True, exist_ok=True)
+        return self.directory
+
+    def get(self, etag: str) -> Optional[Path]:
+        """Return the cached archive for an ETag, or None."""
+        with self._lock:
+            if etag not in self._entries:
+                return None
+            self._entries.move_to_end(etag)
+            return self._path(etag)
+
+    def __contains__(self, etag: str) -> bool:
+        with self._lock:
+            return etag in self._entries
+
+    def _add(self, etag: str, size: int):
+        """Register a finished archive and evict until within budget. Caller holds the lock."""
+        self._entries[etag] = size
+        self.size += size
+        # The newest entry always stays, it is about to be used
+        while self.size > self.max_bytes and len(self._entries) > 1:
+            old, old_size = self._entries.popitem(last=False)
+            self.size -= old_size
+            try:
+                os.unlink(self._path(old))
+            except OSError:
+                pass
+
+    def record(self, etag: str, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """
+        Pass archive chunks through while writing them to the cache.
+
+        Only one build per ETag is recorded at a time. The file is kept when
+        the stream runs to its end and discarded if it is abandoned, fails
+        or grows past max_bytes.
+        """
+        with self._lock:
+            recording = etag not in self._entries and etag not in self._building
+            if recording:
+                self._building.add(etag)
+        if not recording:
+            yield from chunks
+            return
+
+        out = None
+        tmp_path = None
+        size = 0
+        iterator = iter(chunks)
+        try:
+            try:
+                fd, tmp_path = tempfile.mkstemp(suffix='.part', dir=self._ensure_directory())
+                out = os.fdopen(fd, 'wb')
+            except OSError as e:
+                print(f"Warning: Could not cache archive: {e}")
+
+            # Look one chunk ahead so the archive is committed as soon as the
+            # last chunk is known, even if the consumer stops right after it
+            chunk = next(iterator, None)
+            while chunk is not None:
+                following = next(iterator, None)
+                if out is not None:
+                    size += len(chunk)
+                    try:
+                        if size <= self.max_bytes:
+                            out.write(chunk)
+                        recorded = size <= self.max_bytes
+                    except OSError:
+                        recorded = False
+                    if not recorded or following is None:
+                        # Too big or disk full only stops the recording,
+                        # the client keeps getting its archive
+                        try:
+                            out.close()
+                        except OSError:
+                            recorded = False
+                        out = None
+                        if recorded and self._commit(etag, tmp_path, size):
+                            tmp_path = None
+                yield chunk
+                chunk = following
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close:
+                close()
+            with self._lock:
+                self._building.discard(etag)
+            if out is not None:
+                out.close()
+            if tmp_path is not None:
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
+
+    def _commit(self, etag: str, tmp_path: str, size: int) -> bool:
+        """Move a completely written archive into place."""
+        with self._lock:
+            try:
+                os.replace(tmp_path, self._path(etag))
+            except OSError as e:
+                print(f"Warning: Could not cache archive: {e}")
+                return False
+            self._add(etag, size)
+            return True
+
+    def clear(self):
+        """Delete every cached archive, and the directory if it was created here."""
+        with self._lock:
+            for etag in self._entries:
+                try:
+                    os.unlink(self._path(etag))
+                except OSError:
+                    pass
+            self._entries.clear()
+            self.size = 0
+            if self._owns_directory and self.directory is not None:
+                shutil.rmtree(self.directory, ignore_errors=True)
+                self.directory = None
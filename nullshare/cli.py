@@ -6,12 +6,19 @@ import os
 import sys
 from pathlib import Path
 from typing import List, Optional
+import threading
 import time
 
-from .server import ShareServer
-from .qr_generator import generate_qr_terminal
+from .shaping import parse_rate
 from .utils import get_local_ip, find_available_port, validate_paths, clear_screen, format_file_size
 
+# Commands import the web server, the QR renderer and HTTP clients only when
+# they run, so 'status', 'stop' and '--help' start without Flask or Pillow.
+# Names of engine.ENGINES, which cannot be imported without Werkzeug.
+ENGINE_NAMES = ('pool', 'werkzeug')
+# Names of archive.ARCHIVE_FORMATS, which pulls in tarfile and zstandard.
+ARCHIVE_FORMAT_NAMES = ('zip', 'tar', 'tar.zst')
+
 # Try to import banner, but don't fail if it doesn't exist
 try:
     from .banner import show_banner, show_share_banner
@@ -19,6 +26,84 @@ try:
 except ImportError:
     HAS_BANNER = False
 
+def local_request(port: int, path: str, timeout: float = 2.0):
+    """GET a path from a server on this machine. Returns the status and body."""
+    import http.client
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+    try:
+        connection.request('GET', path)
+        response = connection.getresponse()
+        return response.status, response.read()
+    finally:
+        connection.close()
+
+class RateType(click.ParamType):
+    """Bytes per second, written like 500K, 20M or 1G."""
+    
+    name = 'rate'
+    
+    def convert(self, value, param, ctx):
+        if isinstance(value, int):
+            return value
+        try:
+            return parse_rate(value)
+        except ValueError as e:
+            self.fail(str(e), param, ctx)
+
+class PrebuildProgress:
+    """Prints archive prebuild progress on a single updating line."""
+    
+    def __init__(self, interval: float = 0.25):
+        self.interval = interval
+        self._last = 0.0
+    
+    def __call__(self, name: str, done: int, total: int):
+        now = time.monotonic()
+        finished = done >= total
+        if not finished and now - self._last < self.interval:
+            return
+        self._last = now
+        
+        percent = 100 * done // total if total else 100
+        line = f"\r\033[94m  Preparing {name}: {percent:3d}% ({format_file_size(done)} / {format_file_size(total)})\033[0m"
+        if finished:
+            line = f"\r\033[92m  ✓ {name} ready ({format_file_size(total)})\033[0m"
+        click.echo(line + "\033[K", nl=finished)
+
+class DownloadMeter:
+    """Prints download progress and throughput on a single updating line."""
+    
+    def __init__(self, progress, interval: float = 0.5):
+        self.progress = progress
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._shown = False
+    
+    def _line(self) -> str:
+        progress = self.progress
+        speed = progress.speed()
+        remaining = max(progress.total_bytes - progress.bytes_done, 0)
+        eta = f"{int(remaining / speed) // 60}:{int(remaining / speed) % 60:02d}" if speed > 0 else "--:--"
+        return (f"\r\033[94m  [{progress.files_done}/{progress.total_files}] "
+                f"{format_file_size(progress.bytes_done)} / {format_file_size(progress.total_bytes)}  "
+                f"{format_file_size(speed)}/s  ETA {eta}\033[0m\033[K")
+    
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            click.echo(self._line(), nl=False)
+            self._shown = True
+    
+    def __enter__(self):
+        self._thread.start()
+        return self
+    
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        if self._shown:
+            click.echo()
+
 @click.group(invoke_without_command=True)
 @click.version_option(version='1.1.0', prog_name='NullShare')
 @click.pass_context
@@ -41,11 +126,42 @@ def cli(ctx):
 @click.option('--timeout', '-t', type=int, help='Auto-stop after N seconds')
 @click.option('--one-time', is_flag=True, help='Files can only be downloaded once')
 @click.option('--no-qr', is_flag=True, help='Do not show QR code')
+@click.option('--qr-style', type=click.Choice(['full', 'compact']), default='full', show_default=True,
+              help='QR code drawing: full blocks, or compact half blocks for small terminals')
 @click.option('--clean', is_flag=True, help='Clear screen before showing QR')
 @click.option('--verbose', '-v', is_flag=True, help='Show detailed information')
 @click.option('--no-banner', is_flag=True, help='Do not show ASCII banner')
-def share(paths, port, no_zip, password, timeout, one_time, no_qr, clean, verbose, no_banner):
+@click.option('--engine', type=click.Choice(ENGINE_NAMES), default='pool', show_default=True,
+              help='Serving engine (pool = fixed worker threads, werkzeug = development server)')
+@click.option('--workers', type=int, default=32, show_default=True, help='Worker threads for the pool engine')
+@click.option('--max-connections', type=int, default=256, show_default=True,
+              help='Connections accepted before new clients wait (pool engine)')
+@click.option('--no-sendfile', is_flag=True, help='Copy file data in Python instead of using sendfile')
+@click.option('--zip-workers', type=int, help='Threads compressing folder archives (default: CPU count)')
+@click.option('--zip-level', type=click.IntRange(0, 9), default=6, show_default=True,
+              help='Deflate level for folder archives, 0 stores files uncompressed')
+@click.option('--cache-size', type=click.IntRange(min=0), default=1024, show_default=True,
+              help='Disk space in MB for built folder archives, 0 disables the cache')
+@click.option('--archive-format', type=click.Choice(ARCHIVE_FORMAT_NAMES), default='zip', show_default=True,
+              help='Format of folder downloads (clients can also pass ?format=)')
+@click.option('--max-rate', type=RateType(), help='Total upload limit in bytes/s, e.g. 20M')
+@click.option('--per-client-rate', type=RateType(), help='Upload limit per client in bytes/s, e.g. 5M')
+@click.option('--max-transfers', type=click.IntRange(min=0), default=16, show_default=True,
+              help='Downloads sent at the same time, 0 for no limit')
+@click.option('--queue-size', type=click.IntRange(min=0), default=8, show_default=True,
+              help='Downloads that may wait for a free slot')
+@click.option('--queue-timeout', type=click.FloatRange(min=0), default=30.0, show_default=True,
+              help='Seconds a download waits before getting a busy response')
+@click.option('--announce/--no-announce', default=False, show_default=True,
+              help='Announce the server on the LAN so "nullshare discover" finds it')
+@click.option('--prebuild', is_flag=True, help='Build folder archives in the background as soon as sharing starts')
+def share(paths, port, no_zip, password, timeout, one_time, no_qr, qr_style, clean, verbose, no_banner,
+          engine, workers, max_connections, no_sendfile, zip_workers, zip_level,
+          cache_size, archive_format, max_rate, per_client_rate, max_transfers, queue_size,
+          queue_timeout, announce, prebuild):
     """Share files/folders via QR code."""
+    from .server import ShareServer
+    from .qr_generator import generate_qr_terminal, generate_qr_terminal_compact
     
     if not paths:
         click.echo("\033[93mError: Please specify at least one file or folder to share.\033[0m")
@@ -69,19 +185,42 @@ def share(paths, port, no_zip, password, timeout, one_time, no_qr, clean, verbos
     if clean and (no_banner or not HAS_BANNER):
         clear_screen()
     
+    from .archive import available_formats
+    if archive_format not in available_formats():
+        click.echo(f"\033[93mError: {archive_format} archives need the zstandard package (pip install zstandard)\033[0m")
+        sys.exit(1)
+    
     # Find available port if not specified
     if port == 0:
         port = find_available_port()
     
     # Start the server
-    server = ShareServer(
-        paths=valid_paths,
-        port=port,
-        zip_folders=not no_zip,
-        password=password,
-        timeout=timeout,
-        one_time=one_time
-    )
+    try:
+        server = ShareServer(
+            paths=valid_paths,
+            port=port,
+            zip_folders=not no_zip,
+            password=password,
+            timeout=timeout,
+            one_time=one_time,
+            engine=engine,
+            workers=workers,
+            max_connections=max_connections,
+            use_sendfile=not no_sendfile,
+            zip_workers=zip_workers,
+            zip_level=zip_level,
+            cache_size=cache_size * 1024 * 1024,
+            archive_format=archive_format,
+            max_rate=max_rate,
+            per_client_rate=per_client_rate,
+            max_transfers=max_transfers,
+            queue_size=queue_size,
+            queue_timeout=queue_timeout,
+            announce=announce
+        )
+    except ValueError as e:
+        click.echo(f"\033[93mError: {e}\033[0m")
+        sys.exit(1)
     
     try:
         server.start()
@@ -99,13 +238,16 @@ def share(paths, port, no_zip, password, timeout, one_time, no_qr, clean, verbos
     click.echo("\033[91m=\033[0m"*60)
     
     click.echo(f"\n\033[91m+++ Server IP:   {click.style(ip, fg='cyan', bold=True)}\033[0m")
-    click.echo(f"\033[91m+++ Port:       {click.style(str(port), fg='cyan', bold=True)}\033[0m")
+    click.echo(f"\033[91m+++ Port:       {click.style(str(server.port), fg='cyan', bold=True)}\033[0m")
     click.echo(f"\033[91m+++ URL:        {click.style(url, fg='cyan', underline=True, bold=True)}\033[0m")
     
     if password:
         click.echo(f"\033[91m+++ Password:   {click.style('Enabled', fg='cyan', bold=True)}\033[0m")
         click.echo(f"\033[91m+++ Token:      {click.style(server.access_token, fg='cyan', bold=True)}\033[0m")
     
+    if server.beacon is not None:
+        click.echo(f"\033[91m+++ Announced:  {click.style('on the LAN (UDP multicast)', fg='cyan', bold=True)}\033[0m")
+    
     # Display files
     click.echo(f"\n\033[91m>>>> Sharing {click.style(str(len(valid_paths)), fg='cyan', bold=True)} item(s):\033[0m")
     for i, path in enumerate(valid_paths, 1):
@@ -113,13 +255,17 @@ def share(paths, port, no_zip, password, timeout, one_time, no_qr, clean, verbos
             size = format_file_size(path.stat().st_size)
             click.echo(f"\033[94m  {i}. File: {path.name} ({size})\033[0m")
         else:
-            file_count = len(list(path.rglob('*')))
+            snapshot = server.file_index.folder(path)
+            file_count = snapshot.file_count if snapshot else 0
             click.echo(f"  {i}. Folder: {path.name}/ ({file_count} files)")
     
     # Display QR code
     if not no_qr:
         click.echo("\n\033[91m>>>> Scan this QR code with your phone camera:\033[0m")
-        qr_text = generate_qr_terminal(url)
+        if qr_style == 'compact':
+            qr_text = generate_qr_terminal_compact(url)
+        else:
+            qr_text = generate_qr_terminal(url)
         click.echo(qr_text)
     
     click.echo("\n\033[91m>>>>>> Transfer Status:\033[0m")
@@ -134,6 +280,12 @@ def share(paths, port, no_zip, password, timeout, one_time, no_qr, clean, verbos
     click.echo("\n\033[93m   Press Ctrl+C to stop sharing\033[0m")
     click.echo("\033[93m=\033[0m"*60 + "\n")
     
+    if prebuild:
+        if no_zip or not cache_size:
+            click.echo("\033[93mWarning: --prebuild needs zipped folders and a non-zero --cache-size\033[0m")
+        elif server.prebuild_archives(on_progress=PrebuildProgress()) is None:
+            click.echo("\033[93mNo folders to prebuild\033[0m")
+    
     try:
         # Keep server running
         if verbose:
@@ -141,18 +293,25 @@ def share(paths, port, no_zip, password, timeout, one_time, no_qr, clean, verbos
             start_time = time.time()
             download_count = 0
         
-        while True:
-            time.sleep(1)
+        # Wakes up right away when the server stops through /shutdown or --timeout
+        while not server.wait_for_stop(timeout=1):
             if verbose:
                 current_time = time.time()
                 elapsed = int(current_time - start_time)
                 # Show stats every 10 seconds
                 if elapsed % 10 == 0:
-                    click.echo(f"[{elapsed}s] Server running - Downloads: {server.stats['total_downloads']}")
+                    click.echo(f"[{elapsed}s] Server running - Downloads: {server.stats.total_downloads}")
     except KeyboardInterrupt:
-        click.echo("\n\n\033[93mStopping server...\033[0m")
-        server.stop()
-        click.echo("\033[93mServer stopped successfully!\033[0m")
+        click.echo("\n\n\033[93mStopping server, letting running downloads finish...\033[0m")
+        try:
+            drained = server.stop()
+        except KeyboardInterrupt:
+            # Second Ctrl+C: exit right away, cutting running downloads off
+            drained = False
+        if drained:
+            click.echo("\033[93mServer stopped successfully!\033[0m")
+        else:
+            click.echo("\033[93mServer stopped, unfinished downloads were cut off\033[0m")
         sys.exit(0)
 
 @cli.command()
@@ -161,12 +320,11 @@ def share(paths, port, no_zip, password, timeout, one_time, no_qr, clean, verbos
 def status(port, json):
     """Check if a NullShare server is running."""
     try:
-        import requests
-        response = requests.get(f'http://127.0.0.1:{port}/api/status', timeout=2)
-        if response.status_code == 200:
-            data = response.json()
+        import json as json_module
+        status_code, body = local_request(port, '/api/status')
+        if status_code == 200:
+            data = json_module.loads(body)
             if json:
-                import json as json_module
                 click.echo(json_module.dumps(data, indent=2))
             else:
                 click.echo(f"✓ NullShare server is running on port {port}")
@@ -191,12 +349,11 @@ def status(port, json):
 def stop(port, force):
     """Stop a running NullShare server."""
     try:
-        import requests
         if not force:
             click.confirm(f"\033[93mAre you sure you want to stop the server on port {port}?\033[0m", abort=True)
         
-        response = requests.get(f'http://127.0.0.1:{port}/shutdown', timeout=2)
-        if response.status_code == 200:
+        status_code, _ = local_request(port, '/shutdown')
+        if status_code == 200:
             click.echo(f"✓ NullShare server on port {port} stopped successfully")
         else:
             click.echo(f"✗ Could not stop server on port {port}")
@@ -205,75 +362,73 @@ def stop(port, force):
 
 @cli.command()
 @click.option('--scan', '-s', is_flag=True, help='Scan network for servers')
-def discover(scan):
-    """Discover NullShare servers on local network."""
+@click.option('--ports', default='8000-8010', show_default=True,
+              help='Ports to probe, e.g. 8000-8010,9000')
+@click.option('--subnet', help='Network to scan, e.g. 192.168.1.0/24 (default: the local /24)')
+@click.option('--concurrency', type=click.IntRange(min=1), default=1024, show_default=True,
+              help='Connections in flight at once')
+@click.option('--timeout', type=click.FloatRange(min=0.05), default=0.4, show_default=True,
+              help='Seconds to wait for each connection')
+@click.option('--wait', '-w', type=click.FloatRange(min=0.1), default=2.0, show_default=True,
+              help='Seconds to listen for server announcements')
+def discover(scan, ports, subnet, concurrency, timeout, wait):
+    """Discover NullShare servers on local network.
+    
+    Servers started with --announce announce themselves on the LAN, and by
+    default this just listens for them. Use --scan to probe every host for
+    servers that do not announce themselves.
+    """
+    from .discovery import listen, max_concurrency, parse_ports, scan as scan_network, subnet_hosts
+    
+    def show(server):
+        name = f" ({server['name']})" if server.get('name') else ""
+        click.echo(f"  • {server['ip']}:{server['port']}{name}")
+        if server['protected']:
+            click.echo("    Password protected")
+        else:
+            click.echo(f"    Files: {server['files']}, Uptime: {server['uptime']}")
+        click.echo(f"    URL: http://{server['ip']}:{server['port']}/")
+        click.echo()
+    
     if not scan:
-        click.echo("Discovering NullShare servers on local network...")
-        click.echo("\nOptions:")
-        click.echo("  --scan, -s    Scan network for active servers")
-        click.echo("\nRun 'nullshare share <file>' to start sharing!")
+        click.echo("\033[93mListening for NullShare servers on the local network...\033[0m\n")
+        try:
+            found_servers = listen(timeout=wait, on_found=show)
+        except OSError as e:
+            click.echo(f"Error listening for servers: {e}")
+            click.echo("Try 'nullshare discover --scan' instead.")
+            return
+        if found_servers:
+            click.echo(f"Found {len(found_servers)} NullShare server(s)")
+        else:
+            click.echo("No NullShare servers announced themselves.")
+            click.echo("\nServers started without --announce: nullshare discover --scan")
+            click.echo("To start sharing: nullshare share <file>")
         return
     
-    click.echo("\033[93mScanning local network for NullShare servers...\033[0m")
-    click.echo("\033[93m(This may take a few seconds)\n\033[0m")
+    try:
+        port_list = parse_ports(ports)
+        hosts = subnet_hosts(get_local_ip(), subnet)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    
+    click.echo(f"\033[93mScanning {len(hosts)} hosts on {len(port_list)} port(s) for NullShare servers...\033[0m\n")
     
+    started = time.monotonic()
     try:
-        import requests
-        from concurrent.futures import ThreadPoolExecutor, as_completed
-        import socket
-        
-        # Get local network
-        local_ip = get_local_ip()
-        network_prefix = ".".join(local_ip.split(".")[:3])
-        
-        found_servers = []
-        
-        def check_host(ip):
-            try:
-                socket.setdefaulttimeout(0.5)
-                s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                s.connect((ip, 8000))
-                s.close()
-                
-                # Try to get status
-                response = requests.get(f'http://{ip}:8000/api/status', timeout=1)
-                if response.status_code == 200:
-                    data = response.json()
-                    found_servers.append({
-                        'ip': ip,
-                        'port': 8000,
-                        'files': data['files_count'],
-                        'uptime': data['uptime']
-                    })
-                    return ip
-            except:
-                pass
-            return None
-        
-        # Scan ports 8000-8010 on network
-        with ThreadPoolExecutor(max_workers=20) as executor:
-            futures = []
-            for i in range(1, 255):
-                ip = f"{network_prefix}.{i}"
-                futures.append(executor.submit(check_host, ip))
-            
-            for future in as_completed(futures):
-                pass  # Results collected in found_servers
-        
-        if found_servers:
-            click.echo(f"Found {len(found_servers)} NullShare server(s):\n")
-            for server in found_servers:
-                click.echo(f"  • {server['ip']}:{server['port']}")
-                click.echo(f"    Files: {server['files']}, Uptime: {server['uptime']}")
-                click.echo(f"    URL: http://{server['ip']}:{server['port']}/")
-                click.echo()
-        else:
-            click.echo("No NullShare servers found on the network.")
-            click.echo("\nTo start sharing: nullshare share <file>")
-            
-    except Exception as e:
+        found_servers = scan_network(hosts, port_list, concurrency=max_concurrency(concurrency),
+                                     connect_timeout=timeout, on_found=show)
+    except OSError as e:
         click.echo(f"Error scanning network: {e}")
         click.echo("\nRun 'nullshare share <file>' to start sharing!")
+        return
+    elapsed = time.monotonic() - started
+    
+    if found_servers:
+        click.echo(f"Found {len(found_servers)} NullShare server(s) in {elapsed:.1f}s")
+    else:
+        click.echo(f"No NullShare servers found on the network ({elapsed:.1f}s).")
+        click.echo("\nTo start sharing: nullshare share <file>")
 
 @cli.command()
 @click.option('--update', is_flag=True, help='Check for updates')
@@ -307,36 +462,56 @@ def version(update):
 
 @cli.command()
 @click.argument('url')
-@click.option('--output', '-o', type=click.Path(), help='Output directory')
-def download(url, output):
-    """Download files from a NullShare server URL."""
+@click.option('--output', '-o', type=click.Path(file_okay=False), help='Output directory')
+@click.option('--jobs', '-j', type=click.IntRange(min=1), default=4, show_default=True,
+              help='Files downloaded at the same time')
+@click.option('--segments', '-s', type=click.IntRange(min=1), default=4, show_default=True,
+              help='Parallel Range requests per large file')
+@click.option('--format', 'archive_format', type=click.Choice(sorted(ARCHIVE_FORMAT_NAMES)),
+              help='Archive format for shared folders (default: the server\'s)')
+def download(url, output, jobs, segments, archive_format):
+    """Download files from a NullShare server URL.
+    
+    URL is the address shown by 'nullshare share', including ?token= for
+    password protected shares, or a single /download/ link. Interrupted
+    downloads resume when the command is run again.
+    """
+    from .client import DownloadClient, DownloadError, DownloadProgress
+    
+    output_path = Path(output) if output else Path.cwd()
+    output_path.mkdir(parents=True, exist_ok=True)
+    
+    client = DownloadClient(url, output_path, jobs=jobs, segments=segments,
+                            archive_format=archive_format)
     try:
-        import requests
-        from urllib.parse import urlparse
-        
-        click.echo(f"Downloading from: {url}")
-        
-        if output:
-            output_path = Path(output)
-            output_path.mkdir(parents=True, exist_ok=True)
-        else:
-            output_path = Path.cwd()
+        click.echo(f"Connecting to {client.base_url}...")
+        try:
+            files = client.list_files()
+        except DownloadError as e:
+            click.echo(f"\033[91m✗ {e}\033[0m")
+            sys.exit(1)
+        if not files:
+            click.echo("The server is not sharing any files.")
+            return
         
-        # Try to get file list
-        parsed = urlparse(url)
-        base_url = f"{parsed.scheme}://{parsed.netloc}"
+        total = sum(remote.size or 0 for remote in files)
+        click.echo(f"Downloading {len(files)} file(s) ({format_file_size(total)}) to {output_path}")
         
-        response = requests.get(f"{base_url}/", timeout=5)
-        if response.status_code == 200:
-            # Simple download - in real app, parse HTML for file list
-            click.echo("Connected to server!")
-            click.echo("(Note: Direct download from CLI is not fully implemented)")
-            click.echo("Visit the URL in your browser to download files.")
-        else:
-            click.echo("Could not connect to server.")
-            
-    except Exception as e:
-        click.echo(f"Error: {e}")
+        progress = DownloadProgress()
+        started = time.monotonic()
+        with DownloadMeter(progress):
+            failures = client.download_all(files, progress)
+        elapsed = max(time.monotonic() - started, 1e-6)
+    finally:
+        client.close()
+    
+    done = len(files) - len(failures)
+    click.echo(f"\033[92m✓ {done} file(s) downloaded in {elapsed:.1f}s "
+               f"({format_file_size(progress.bytes_done / elapsed)}/s average)\033[0m")
+    for remote, error in failures:
+        click.echo(f"\033[91m✗ {remote.name}: {error}\033[0m")
+    if failures:
+        sys.exit(1)
 
 def main():
     """Main entry point."""
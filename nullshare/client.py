@@ -0,0 +1,530 @@
+"""
+NullShare download client
+"""
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path, PurePosixPath
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, quote, unquote, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .archive import ARCHIVE_FORMATS
+from .listing import MAX_PAGE_SIZE
+
+CHUNK_SIZE = 256 * 1024
+
+# Files smaller than this are fetched with a single request
+MIN_SEGMENT_SIZE = 8 * 1024 * 1024
+
+# Longest wait honoured from a Retry-After header
+MAX_RETRY_WAIT = 60
+
+_CONTENT_RANGE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+# How often the resume state of a download in progress is written
+_STATE_INTERVAL = 1.0
+
+
+class DownloadError(Exception):
+    """A file could not be downloaded."""
+
+
+class RemoteFile:
+    """One entry of a server's file list."""
+
+    __slots__ = ('name', 'url', 'size', 'type')
+
+    def __init__(self, name: str, url: str, size: Optional[int] = None, type: str = 'file'):
+        self.name = name
+        self.url = url
+        self.size = size
+        self.type = type
+
+
+class DownloadProgress:
+    """Byte and file counters shared by all downloads of a run."""
+
+    def __init__(self):
+        self.total_files = 0
+        self.total_bytes = 0
+        self.files_done = 0
+        self.bytes_done = 0
+        self._transferred = 0
+        self._lock = threading.Lock()
+        self._samples: deque = deque()
+
+    def expect(self, files: int, size: int):
+        with self._lock:
+            self.total_files += files
+            self.total_bytes += size
+
+    def add(self, amount: int, transferred: bool = True):
+        """Count bytes written; transferred=False for bytes kept from an earlier run."""
+        with self._lock:
+            self.bytes_done += amount
+            if transferred:
+                self._transferred += amount
+
+    def file_done(self):
+        with self._lock:
+            self.files_done += 1
+
+    def speed(self, window: float = 3.0) -> float:
+        """Bytes per second over the last window seconds."""
+        now = time.monotonic()
+        with self._lock:
+            self._samples.append((now, self._transferred))
+            while len(self._samples) > 2 and now - self._samples[0][0] > window:
+                self._samples.popleft()
+            first_time, first_bytes = self._samples[0]
+            elapsed = now - first_time
+            return (self._transferred - first_bytes) / elapsed if elapsed > 0 else 0.0
+
+
+class _Segment:
+    """Byte range [start, end) of a file, written up to pos."""
+
+    __slots__ = ('start', 'end', 'pos', 'active')
+
+    def __init__(self, start: int, end: Optional[int], pos: Optional[int] = None):
+        self.start = start
+        self.end = end
+        self.pos = start if pos is None else pos
+        self.active = False
+
+    @property
+    def done(self) -> bool:
+        return self.end is not None and self.pos >= self.end
+
+
+class DownloadClient:
+    """
+    Downloads files from a NullShare server.
+
+    The file list comes from /api/files. Files are fetched jobs at a time
+    over one pooled session, and files large enough are split into up to
+    segments Range requests running in parallel. Folder archives are
+    fetched in one stream, since the server may build them on the fly. Partial downloads are kept
+    as <name>.part with a <name>.part.json resume state next to them, so an
+    interrupted run continues where it stopped.
+
+    The first request of every file asks for everything from its first
+    missing byte and keeps reading until every segment is written,
+    skipping what the other streams already have. The other segments are
+    requested one first and the rest only once it was served, so when they
+    cannot be fetched, for example because the link is one-time, the first
+    stream simply carries on through them.
+    """
+
+    def __init__(self, url: str, output_dir: Path, jobs: int = 4, segments: int = 4,
+                 min_segment_size: int = MIN_SEGMENT_SIZE, archive_format: Optional[str] = None,
+                 retries: int = 5, timeout: float = 30.0, chunk_size: int = CHUNK_SIZE):
+        parsed = urlparse(url if '://' in url else f'http://{url}')
+        self.base_url = f'{parsed.scheme}://{parsed.netloc}'
+        self.path = parsed.path
+        self.token = parse_qs(parsed.query).get('token', [None])[0]
+        self.output_dir = output_dir
+        self.jobs = max(1, jobs)
+        self.segments = max(1, segments)
+        self.min_segment_size = min_segment_size
+        self.archive_format = archive_format
+        self.retries = retries
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.jobs * self.segments)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._cancelled = threading.Event()
+
+    def close(self):
+        self.session.close()
+
+    def _params(self, **params) -> Dict[str, str]:
+        if self.token:
+            params['token'] = self.token
+        return {key: value for key, value in params.items() if value is not None}
+
+    def _wait(self, seconds: float):
+        if self._cancelled.wait(seconds):
+            raise DownloadError("Cancelled")
+
+    def _get(self, url: str, params: Dict[str, str], headers: Optional[Dict[str, str]] = None,
+             stream: bool = False) -> requests.Response:
+        """GET with retries for connection errors and busy servers."""
+        delay = 1.0
+        for attempt in range(self.retries + 1):
+            last = attempt == self.retries
+            try:
+                response = self.session.get(url, params=params, headers=headers,
+                                            stream=stream, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if last:
+                    raise DownloadError(f"Could not connect: {e}")
+                self._wait(delay)
+                delay = min(delay * 2, MAX_RETRY_WAIT)
+                continue
+
+            if response.status_code == 503 and not last:
+                # The server queue is full; it says when to come back
+                try:
+                    wait = int(response.headers.get('Retry-After', delay))
+                except ValueError:
+                    wait = delay
+                response.close()
+                self._wait(min(max(wait, 1), MAX_RETRY_WAIT))
+                continue
+            if response.status_code in (200, 206):
+                return response
+
+            status = response.status_code
+            response.close()
+            if status == 401:
+                raise DownloadError("Access denied, the URL needs the token shown by the server")
+            if status == 404:
+                raise DownloadError("Not found on the server")
+            if status == 410:
+                raise DownloadError("Already downloaded, the link was one-time")
+            raise DownloadError(f"Server answered {status}")
+        raise DownloadError("Server busy, try again later")
+
+    def list_files(self) -> List[RemoteFile]:
+        """
+        Return the files to download.
+
+        A /download/ URL means that one file, anything else the whole share.
+        """
+        if self.path.startswith('/download/'):
+            name = unquote(self.path[len('/download/'):])
+            return [RemoteFile(name, f'/download/{name}')]
+
+        files = []
+        cursor = None
+        seen = set()
+        while True:
+            response = self._get(f'{self.base_url}/api/files',
+                                 self._params(limit=str(MAX_PAGE_SIZE), cursor=cursor))
+            try:
+                page = response.json()
+            except ValueError:
+                raise DownloadError("The server has no file list API, it may be an older NullShare")
+            for item in page['items']:
+                files.append(RemoteFile(item['name'], item['url'], item.get('size'), item.get('type', 'file')))
+            cursor = page.get('next_cursor')
+            if not cursor:
+                return files
+            if cursor in seen:
+                raise DownloadError("The server sent the same page of its file list twice")
+            seen.add(cursor)
+
+    def _target(self, remote: RemoteFile) -> Tuple[str, Optional[str]]:
+        """Local name and ?format= value for a file."""
+        name = remote.name
+        if remote.type != 'folder' or not self.archive_format:
+            return name, None
+        for suffix, _ in sorted(ARCHIVE_FORMATS.values(), key=lambda item: -len(item[0])):
+            if name.endswith(suffix):
+                name = name[:-len(suffix)]
+                break
+        return name + ARCHIVE_FORMATS[self.archive_format][0], self.archive_format
+
+    def _destination(self, name: str) -> Path:
+        # Never let a name from the server escape the output directory
+        parts = [part for part in PurePosixPath(name).parts if part not in ('/', '.', '..')]
+        if not parts:
+            raise DownloadError(f"Invalid file name: {name!r}")
+        return self.output_dir.joinpath(*parts)
+
+    def download_all(self, files: List[RemoteFile], progress: Optional[DownloadProgress] = None
+                     ) -> List[Tuple[RemoteFile, Exception]]:
+        """Download files concurrently. Returns the ones that failed, with the error."""
+        progress = progress or DownloadProgress()
+        progress.expect(len(files), sum(remote.size or 0 for remote in files))
+        failures = []
+        with ThreadPoolExecutor(max_workers=self.jobs) as files_pool, \
+                ThreadPoolExecutor(max_workers=self.jobs * max(self.segments - 1, 1)) as segments_pool:
+            futures = [(remote, files_pool.submit(self.download, remote, progress, segments_pool))
+                       for remote in files]
+            try:
+                for remote, future in futures:
+                    try:
+                        future.result()
+                    except (DownloadError, OSError) as e:
+                        failures.append((remote, e))
+            except KeyboardInterrupt:
+                # Streams stop at their next chunk and keep their resume state
+                self._cancelled.set()
+                raise
+        return failures
+
+    def download(self, remote: RemoteFile, progress: DownloadProgress,
+                 pool: Optional[ThreadPoolExecutor] = None) -> Path:
+        """Download one file, resuming a previous attempt if there is one."""
+        if self._cancelled.is_set():
+            raise DownloadError("Cancelled")
+        name, archive_format = self._target(remote)
+        dest = self._destination(name)
+        if remote.type == 'file' and remote.size is not None and dest.is_file() \
+                and dest.stat().st_size == remote.size:
+            progress.add(remote.size, transferred=False)
+            progress.file_done()
+            return dest
+
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        part = dest.with_name(dest.name + '.part')
+        state_path = dest.with_name(dest.name + '.part.json')
+        url = self.base_url + quote(remote.url)
+        params = self._params(format=archive_format)
+
+        state = self._load_state(state_path, url) if part.exists() else None
+        start = state['segments'][0][1] if state else 0
+        headers = {'Range': f'bytes={start}-'}
+        if state:
+            headers['If-Range'] = state['etag']
+        response = self._get(url, params, headers, stream=True)
+
+        try:
+            etag = response.headers.get('ETag')
+            match = _CONTENT_RANGE.match(response.headers.get('Content-Range', ''))
+            if response.status_code == 206 and match and int(match.group(1)) == start:
+                length = int(match.group(3))
+            else:
+                # No ranges, or the file changed since the last attempt
+                state = None
+                start = 0
+                content_length = response.headers.get('Content-Length')
+                length = int(content_length) if content_length is not None else None
+            resumable = response.status_code == 206 and etag is not None and not etag.startswith('W/')
+
+            if state:
+                segments = [_Segment(seg_start, seg_end, pos) for seg_start, pos, seg_end in state['segments']]
+                kept = length - sum(seg.end - seg.pos for seg in segments)
+            else:
+                # Every range of a folder archive may be a fresh build on the
+                # server, so parallel segments would only multiply that work
+                segmented = resumable and remote.type != 'folder'
+                segments = self._split(length) if segmented else [_Segment(0, length)]
+                kept = 0
+            if length is not None:
+                # Archives differ in size from the files they hold
+                progress.expect(0, length - (remote.size or 0))
+            progress.add(kept, transferred=False)
+
+            mode = 'r+b' if part.exists() and state else 'wb'
+            with open(part, mode) as f:
+                if length is not None and resumable:
+                    f.truncate(length)
+            job = _FileJob(self, url, params, etag if resumable else None, part, state_path,
+                           length, segments, progress)
+            job.save_state()
+            job.run(response, pool)
+        finally:
+            response.close()
+
+        if not all(seg.done for seg in segments):
+            raise DownloadError(job.error or "Download ended early, run the command again to resume")
+        os.replace(part, dest)
+        try:
+            state_path.unlink()
+        except OSError:
+            pass
+        progress.file_done()
+        return dest
+
+    def _split(self, length: int) -> List[_Segment]:
+        count = max(1, min(self.segments, length // self.min_segment_size))
+        size = -(-length // count)
+        return [_Segment(start, min(start + size, length)) for start in range(0, length, size)] \
+            or [_Segment(0, 0)]
+
+    @staticmethod
+    def _load_state(state_path: Path, url: str) -> Optional[dict]:
+        try:
+            state = json.loads(state_path.read_text())
+        except (OSError, ValueError):
+            return None
+        if state.get('url') != url or not state.get('etag') or not state.get('segments'):
+            return None
+        return state
+
+
+class _FileJob:
+    """The streams of one file download writing into its .part file."""
+
+    def __init__(self, client: DownloadClient, url: str, params: Dict[str, str], etag: Optional[str],
+                 part: Path, state_path: Path, length: Optional[int], segments: List[_Segment],
+                 progress: DownloadProgress):
+        self.client = client
+        self.url = url
+        self.params = params
+        self.etag = etag
+        self.part = part
+        self.state_path = state_path
+        self.length = length
+        self.segments = segments
+        self.progress = progress
+        self.error: Optional[str] = None
+        self._lock = threading.Lock()
+        self._saved = time.monotonic()
+
+    def run(self, response: requests.Response, pool: Optional[ThreadPoolExecutor]):
+        first = self.segments[0]
+        first.active = True
+        later = None
+        if pool is not None and self.etag is not None and len(self.segments) > 1:
+            later = pool.submit(self._fetch_later, pool)
+        try:
+            try:
+                self._pump(response, first, first.pos, open_ended=True)
+            except requests.RequestException as e:
+                if self.etag is None:
+                    raise DownloadError(f"Connection lost: {e}")
+                self.error = f"Connection lost: {e}"
+            finally:
+                with self._lock:
+                    first.active = False
+            if later is not None:
+                later.result()
+
+            # Whatever a failed stream left behind is fetched again
+            for _ in range(self.client.retries):
+                missing = [seg for seg in self.segments if not seg.done and not seg.active]
+                if not missing or self.etag is None:
+                    break
+                for seg in missing:
+                    self._fetch(seg)
+        finally:
+            self.save_state(force=True)
+
+    def _fetch_later(self, pool: ThreadPoolExecutor):
+        """
+        Fetch the segments after the first, in parallel once the server has
+        served one of them. A server refusing extra requests costs one.
+        """
+        futures = []
+
+        def fan_out():
+            futures.extend(pool.submit(self._fetch, seg) for seg in self.segments[2:])
+
+        self._fetch(self.segments[1], on_start=fan_out)
+        for future in futures:
+            future.result()
+
+    def _fetch(self, seg: _Segment, on_start: Optional[Callable[[], None]] = None):
+        """Fetch what is missing of one segment with its own request."""
+        with self._lock:
+            if seg.active or seg.done:
+                return
+            seg.active = True
+            # Another stream may move pos on while this request is in flight
+            start = seg.pos
+        try:
+            headers = {'Range': f'bytes={start}-{seg.end - 1}', 'If-Range': self.etag}
+            response = self.client._get(self.url, self.params, headers, stream=True)
+        except DownloadError as e:
+            # The segment stays missing, a neighbouring stream or a retry
+            # may still get it
+            self.error = str(e)
+            with self._lock:
+                seg.active = False
+            return
+        try:
+            if response.status_code != 206:
+                raise DownloadError("File changed on the server during the download")
+            match = _CONTENT_RANGE.match(response.headers.get('Content-Range', ''))
+            if not match or int(match.group(1)) != start:
+                raise DownloadError("Server answered with a different range than requested")
+            if on_start is not None:
+                on_start()
+            self._pump(response, seg, start, open_ended=False)
+        except requests.RequestException as e:
+            self.error = f"Connection lost: {e}"
+        finally:
+            response.close()
+            with self._lock:
+                seg.active = False
+
+    def _advance(self, seg: _Segment) -> Optional[_Segment]:
+        """The segment after seg, or None once it and all after it are written."""
+        with self._lock:
+            following = self.segments[self.segments.index(seg) + 1:]
+            if all(other.done for other in following):
+                return None
+            return following[0]
+
+    def _pump(self, response: requests.Response, seg: _Segment, start: int, open_ended: bool):
+        """
+        Write a response body into the part file from start, the offset the
+        request asked for.
+
+        Two streams may cover the same bytes; as the ETag matched, they are
+        the same bytes. Bytes written meanwhile by another stream are
+        skipped. An open-ended stream goes on through the following
+        segments until all are done; a segment's own stream stops once
+        another one has got ahead of what it wrote.
+        """
+        offset = start
+        wrote = False
+        with open(self.part, 'r+b') as f:
+            for chunk in response.iter_content(self.client.chunk_size):
+                if self.client._cancelled.is_set():
+                    raise DownloadError("Cancelled")
+                while chunk:
+                    if seg.end is not None and offset >= seg.end:
+                        seg = self._advance(seg) if open_ended else None
+                        if seg is None:
+                            return
+                        continue
+                    with self._lock:
+                        pos = seg.pos
+                    if offset < pos:
+                        if wrote and not open_ended:
+                            return
+                        # Already written by another stream
+                        skip = min(len(chunk), pos - offset)
+                        chunk = chunk[skip:]
+                        offset += skip
+                        continue
+                    take = len(chunk) if seg.end is None else min(len(chunk), seg.end - offset)
+                    f.seek(offset)
+                    f.write(chunk[:take] if take < len(chunk) else chunk)
+                    wrote = True
+                    chunk = chunk[take:]
+                    offset += take
+                    with self._lock:
+                        if offset > seg.pos:
+                            self.progress.add(offset - max(seg.pos, offset - take))
+                            seg.pos = offset
+                self.save_state()
+        with self._lock:
+            if seg.end is None:
+                # A body of unknown length is complete once it ends cleanly
+                seg.end = offset
+
+    def save_state(self, force: bool = False):
+        """Write which byte ranges are still missing, at most every _STATE_INTERVAL."""
+        if self.etag is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._saved < _STATE_INTERVAL:
+                return
+            self._saved = now
+            state = {
+                'url': self.url,
+                'etag': self.etag,
+                'length': self.length,
+                'segments': [[seg.start, seg.pos, seg.end] for seg in self.segments if not seg.done]
+            }
+        try:
+            self.state_path.write_text(json.dumps(state))
+        except OSError:
+            pass
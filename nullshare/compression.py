@@ -0,0 +1,115 @@
+"""
+NullShare response compression
+"""
+import threading
+import zlib
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Only text worth compressing; downloads are sent as they are
+COMPRESSIBLE_TYPES = frozenset({
+    'text/html', 'text/plain', 'text/css', 'text/javascript',
+    'application/json', 'application/javascript', 'image/svg+xml',
+})
+
+# Below this the encoding overhead eats the saving
+MIN_SIZE = 512
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def available_encodings() -> List[str]:
+    """Content codings that can be produced, most preferred first."""
+    return (['br'] if brotli is not None else []) + ['gzip']
+
+
+def negotiate_encoding(header: Optional[str], encodings: Optional[List[str]] = None) -> Optional[str]:
+    """
+    Pick a content coding for an Accept-Encoding header.
+
+    Args:
+        header: Value of the Accept-Encoding header
+        encodings: Codings to choose from, most preferred first
+
+    Returns:
+        The coding with the highest q-value, ties going to the earlier one
+        in encodings, or None to send the body as it is
+    """
+    if not header:
+        return None
+    if encodings is None:
+        encodings = available_encodings()
+
+    qualities = {}
+    for item in header.split(','):
+        name, _, params = item.partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name] = quality
+
+    best = None
+    best_quality = 0.0
+    for encoding in encodings:
+        quality = qualities.get(encoding, qualities.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    """Encode a response body with a content coding from available_encodings()."""
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    if encoding == 'gzip':
+        # wbits 31 writes a gzip wrapper with a zero timestamp, so the
+        # same body always compresses to the same bytes
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        return compressor.compress(data) + compressor.flush()
+    raise ValueError(f"Unsupported content coding '{encoding}'")
+
+
+class EncodedBodyCache:
+    """
+    Recently compressed bodies, keyed by resource, ETag and coding.
+
+    A listing only changes with the file index, so every reload of the same
+    version can reuse the compressed bytes instead of encoding megabytes of
+    HTML again. The resource (path and query) is part of the key because
+    validators only have to be unique per resource.
+    """
+
+    def __init__(self, max_entries: int = 16):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[Tuple[str, str, str], bytes]' = OrderedDict()
+
+    def get(self, resource: str, etag: str, encoding: str) -> Optional[bytes]:
+        key = (resource, etag, encoding)
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+            return data
+
+    def put(self, resource: str, etag: str, encoding: str, data: bytes):
+        key = (resource, etag, encoding)
+        with self._lock:
+            self._entries[key] = data
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
@@ -0,0 +1,325 @@
+"""
+NullShare server discovery
+"""
+import asyncio
+import ipaddress
+import json
+import select
+import socket
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+# Ports tried by default; 'share' picks the first free port from 8000
+DEFAULT_PORTS = range(8000, 8011)
+
+DEFAULT_CONCURRENCY = 1024
+CONNECT_TIMEOUT = 0.4
+READ_TIMEOUT = 1.0
+
+# Status responses are small, anything bigger is not NullShare
+_MAX_RESPONSE = 64 * 1024
+
+# Body a password protected server answers every request with
+_UNAUTHORIZED_BODY = b'Unauthorized: Invalid or missing token'
+
+# Administratively scoped multicast group and port of the announcements
+BEACON_GROUP = '239.255.78.83'
+BEACON_PORT = 47813
+BEACON_INTERVAL = 2.0
+
+# Servers answer queries at most this often, so a burst of listeners does
+# not turn into a burst of announcements
+_QUERY_HOLDOFF = 0.25
+
+_SERVICE = 'nullshare'
+
+
+def parse_ports(spec: str) -> List[int]:
+    """
+    Parse a port list such as '8000-8010,9000'.
+
+    Raises ValueError for anything else.
+    """
+    ports = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        first, _, last = part.partition('-')
+        try:
+            start = int(first)
+            end = int(last) if last else start
+        except ValueError:
+            raise ValueError(f"Invalid port range '{part}'")
+        if not 0 < start <= end <= 65535:
+            raise ValueError(f"Invalid port range '{part}'")
+        ports.extend(range(start, end + 1))
+    if not ports:
+        raise ValueError("No ports given")
+    return sorted(set(ports))
+
+
+def subnet_hosts(local_ip: str, subnet: Optional[str] = None) -> List[str]:
+    """Addresses to probe: the given subnet, or the /24 around local_ip."""
+    network = ipaddress.ip_network(subnet or f'{local_ip}/24', strict=False)
+    return [str(host) for host in network.hosts()]
+
+
+def _parse_status(ip: str, port: int, data: bytes) -> Optional[Dict]:
+    """Turn a raw /api/status response into a server description."""
+    head, _, body = data.partition(b'\r\n\r\n')
+    status_line = head.split(b'\r\n', 1)[0].split()
+    if len(status_line) < 2:
+        return None
+    if status_line[1] == b'401' and body.startswith(_UNAUTHORIZED_BODY):
+        return {'ip': ip, 'port': port, 'protected': True}
+    if status_line[1] != b'200':
+        return None
+    try:
+        status = json.loads(body)
+    except ValueError:
+        return None
+    if not isinstance(status, dict) or 'files_count' not in status:
+        return None
+    return {
+        'ip': ip,
+        'port': port,
+        'protected': False,
+        'files': status['files_count'],
+        'uptime': status.get('uptime')
+    }
+
+
+async def _read_response(reader: asyncio.StreamReader) -> bytes:
+    # Connection: close, so the response ends at EOF
+    data = b''
+    while len(data) < _MAX_RESPONSE:
+        chunk = await reader.read(_MAX_RESPONSE - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+async def _probe(ip: str, port: int, connect_timeout: float, read_timeout: float) -> Optional[Dict]:
+    """Connect to one address and ask it for its NullShare status."""
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), connect_timeout)
+    except (OSError, asyncio.TimeoutError):
+        return None
+    try:
+        writer.write(
+            f'GET /api/status HTTP/1.1\r\nHost: {ip}:{port}\r\nConnection: close\r\n\r\n'.encode('ascii')
+        )
+        data = await asyncio.wait_for(_read_response(reader), read_timeout)
+    except (OSError, asyncio.TimeoutError):
+        return None
+    finally:
+        writer.close()
+    return _parse_status(ip, port, data)
+
+
+async def scan_async(hosts: Iterable[str], ports: Iterable[int],
+                     concurrency: int = DEFAULT_CONCURRENCY,
+                     connect_timeout: float = CONNECT_TIMEOUT,
+                     read_timeout: float = READ_TIMEOUT,
+                     on_found: Optional[Callable[[Dict], None]] = None) -> List[Dict]:
+    """
+    Probe every host and port pair with non-blocking connects.
+
+    At most concurrency connections are in flight. Each server is passed to
+    on_found as soon as it answers, so callers can show results before the
+    scan ends.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    found = []
+
+    async def probe(ip: str, port: int):
+        async with semaphore:
+            server = await _probe(ip, port, connect_timeout, read_timeout)
+        if server is not None:
+            found.append(server)
+            if on_found is not None:
+                on_found(server)
+
+    await asyncio.gather(*(probe(ip, port) for ip in hosts for port in ports))
+    return found
+
+
+def scan(hosts: Iterable[str], ports: Iterable[int], concurrency: int = DEFAULT_CONCURRENCY,
+         connect_timeout: float = CONNECT_TIMEOUT, read_timeout: float = READ_TIMEOUT,
+         on_found: Optional[Callable[[Dict], None]] = None) -> List[Dict]:
+    """Blocking wrapper around scan_async."""
+    return asyncio.run(scan_async(
+        list(hosts), list(ports), concurrency=concurrency, connect_timeout=connect_timeout,
+        read_timeout=read_timeout, on_found=on_found
+    ))
+
+
+def max_concurrency(requested: int) -> int:
+    """Cap a connection count to what the open file limit allows."""
+    try:
+        import resource
+    except ImportError:
+        return requested
+    soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY:
+        return requested
+    # Leave room for the files the process already has open
+    return max(1, min(requested, soft - 64))
+
+
+def _beacon_socket(group: str, port: int, interface: Optional[str]) -> socket.socket:
+    """UDP socket joined to the beacon group, sending to it on interface."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    # Servers and listeners on the same machine all share the port
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if hasattr(socket, 'SO_REUSEPORT'):
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        except OSError:
+            pass
+    sock.bind(('', port))
+    local = socket.inet_aton(interface or '0.0.0.0')
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, socket.inet_aton(group) + local)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+    if interface:
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, local)
+    return sock
+
+
+def _decode(data: bytes) -> Optional[Dict]:
+    try:
+        message = json.loads(data)
+    except ValueError:
+        return None
+    if not isinstance(message, dict) or message.get('service') != _SERVICE:
+        return None
+    return message
+
+
+class Beacon:
+    """
+    Announces a running server on the LAN with UDP multicast.
+
+    An announcement carries the port, the number of shared files and
+    whether a token is needed, never the token itself. It is sent every
+    interval seconds, right away when a listener asks, and a goodbye is
+    sent on stop. Listeners find servers on any port without probing a
+    single host.
+    """
+
+    def __init__(self, port: int, status: Callable[[], Dict], interval: float = BEACON_INTERVAL,
+                 group: str = BEACON_GROUP, beacon_port: int = BEACON_PORT,
+                 interface: Optional[str] = None):
+        self.port = port
+        self.status = status
+        self.interval = interval
+        self.group = group
+        self.beacon_port = beacon_port
+        self.interface = interface
+        self._sock: Optional[socket.socket] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Join the group and start announcing. Raises OSError if that fails."""
+        self._sock = _beacon_socket(self.group, self.beacon_port, self.interface)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop announcing and tell listeners the server is gone."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self._send('bye')
+        self._sock.close()
+        self._sock = None
+
+    def _send(self, kind: str):
+        message = {'service': _SERVICE, 'type': kind, 'port': self.port}
+        if kind == 'announce':
+            message.update(self.status())
+        try:
+            self._sock.sendto(json.dumps(message).encode('utf-8'), (self.group, self.beacon_port))
+        except OSError:
+            # No route right now, e.g. the WiFi dropped; try again next time
+            pass
+
+    def _run(self):
+        next_announce = 0.0
+        while not self._stop.is_set():
+            now = time.monotonic()
+            if now >= next_announce:
+                self._send('announce')
+                next_announce = now + self.interval
+            wait = min(next_announce - now, 0.5)
+            try:
+                readable, _, _ = select.select([self._sock], [], [], max(wait, 0))
+            except (OSError, ValueError):
+                return
+            if not readable:
+                continue
+            try:
+                data, _ = self._sock.recvfrom(2048)
+            except OSError:
+                continue
+            message = _decode(data)
+            if message is not None and message.get('type') == 'query':
+                # Answer on the group soon, every listener benefits
+                next_announce = min(next_announce, time.monotonic() + _QUERY_HOLDOFF)
+
+
+def listen(timeout: float = 2.0, on_found: Optional[Callable[[Dict], None]] = None,
+           group: str = BEACON_GROUP, beacon_port: int = BEACON_PORT,
+           interface: Optional[str] = None) -> List[Dict]:
+    """
+    Collect server announcements for timeout seconds.
+
+    A query is sent first, so running servers answer within a fraction of a
+    second instead of at their next interval. Each server is passed to
+    on_found the first time it is heard.
+    """
+    sock = _beacon_socket(group, beacon_port, interface)
+    found: Dict[tuple, Dict] = {}
+    try:
+        query = json.dumps({'service': _SERVICE, 'type': 'query'}).encode('utf-8')
+        sock.sendto(query, (group, beacon_port))
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            readable, _, _ = select.select([sock], [], [], remaining)
+            if not readable:
+                break
+            data, (ip, _) = sock.recvfrom(2048)
+            message = _decode(data)
+            if message is None or message.get('type') != 'announce':
+                continue
+            try:
+                key = (ip, int(message['port']))
+            except (KeyError, TypeError, ValueError):
+                continue
+            if key in found:
+                continue
+            server = {
+                'ip': ip,
+                'port': key[1],
+                'protected': bool(message.get('protected')),
+                'files': message.get('files'),
+                'uptime': message.get('uptime'),
+                'name': message.get('name')
+            }
+            found[key] = server
+            if on_found is not None:
+                on_found(server)
+    finally:
+        sock.close()
+    return list(found.values())
@@ -0,0 +1,281 @@
+"""
+NullShare serving engines
+"""
+import socket
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Set, Type
+
+from werkzeug.serving import BaseWSGIServer, ThreadedWSGIServer, WSGIRequestHandler
+from werkzeug.wsgi import ClosingIterator
+
+# WSGI environ key holding the client socket, for engines that expose it
+SOCKET_ENVIRON_KEY = 'nullshare.socket'
+
+# How quickly the accept loop notices shutdown()
+SHUTDOWN_POLL_INTERVAL = 0.1
+
+
+def _listen(host: str, port: int) -> socket.socket:
+    """
+    Bind a listening socket. Raises OSError on failure, where werkzeug
+    would print the error and exit the process.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host, port))
+        sock.listen(socket.SOMAXCONN)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def _serve_on(server_class, host: str, port: int, *args, **kwargs):
+    """Create a werkzeug server on a socket bound by _listen."""
+    sock = _listen(host, port)
+    try:
+        # The server takes a duplicate of the descriptor
+        return server_class(host, port, *args, fd=sock.fileno(), **kwargs)
+    finally:
+        sock.close()
+
+
+class _RequestTracker:
+    """WSGI middleware counting requests until their response is closed."""
+
+    def __init__(self, app):
+        self.app = app
+        self.active = 0
+        self._idle = threading.Condition()
+
+    def __call__(self, environ, start_response):
+        with self._idle:
+            self.active += 1
+        try:
+            body = self.app(environ, start_response)
+        except BaseException:
+            self._finished()
+            raise
+        return ClosingIterator(body, self._finished)
+
+    def _finished(self):
+        with self._idle:
+            self.active -= 1
+            self._idle.notify_all()
+
+    def wait_idle(self, timeout: float) -> bool:
+        """Wait for in-flight requests to finish. Returns True if they did."""
+        deadline = time.monotonic() + timeout
+        with self._idle:
+            while self.active:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+
+class ServingEngine(ABC):
+    """
+    Runs a WSGI app on a listening socket.
+
+    The socket is bound and listening when the engine is created, so bind
+    errors surface in the caller and connections queue up from then on.
+    port is the bound port, also when 0 was asked for. serve_forever()
+    blocks until shutdown() is called from another thread.
+    """
+
+    name = ''
+
+    def __init__(self, app, host: str, port: int, workers: int = 32,
+                 max_connections: int = 256):
+        self.tracker = _RequestTracker(app)
+        self.app = self.tracker
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.max_connections = max_connections
+
+    @abstractmethod
+    def serve_forever(self):
+        """Serve requests until shutdown() is called."""
+
+    @abstractmethod
+    def shutdown(self, timeout: float = 10.0) -> bool:
+        """
+        Stop accepting and close the listening socket, give in-flight
+        requests up to timeout seconds to finish, then cut the connections
+        still open.
+
+        Returns True if every request finished in time.
+        """
+
+
+class _ConnectionTrackingMixIn:
+    """Remembers open client connections, so shutdown can cut them."""
+
+    def __init__(self, *args, **kwargs):
+        self._connections: Set[socket.socket] = set()
+        self._connections_lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+    def _track(self, request):
+        with self._connections_lock:
+            self._connections.add(request)
+
+    def process_request(self, request, client_address):
+        self._track(request)
+        super().process_request(request, client_address)
+
+    def shutdown_request(self, request):
+        with self._connections_lock:
+            self._connections.discard(request)
+        super().shutdown_request(request)
+
+    def close_connections(self):
+        """
+        Cut every open connection: transfers still running after the drain
+        timeout, and connections that have not sent their request yet,
+        which would otherwise hold their thread until the socket timeout.
+        """
+        with self._connections_lock:
+            connections = list(self._connections)
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class _ThreadedWSGIServer(_ConnectionTrackingMixIn, ThreadedWSGIServer):
+    pass
+
+
+class WerkzeugEngine(ServingEngine):
+    """Werkzeug's development server, one thread per connection."""
+
+    name = 'werkzeug'
+
+    def __init__(self, app, host: str, port: int, **options):
+        super().__init__(app, host, port, **options)
+        self.httpd = _serve_on(_ThreadedWSGIServer, host, port, self.app)
+        self.port = self.httpd.port
+
+    def serve_forever(self):
+        self.httpd.serve_forever(poll_interval=SHUTDOWN_POLL_INTERVAL)
+
+    def shutdown(self, timeout: float = 10.0) -> bool:
+        self.httpd.shutdown()
+        drained = self.tracker.wait_idle(timeout)
+        self.httpd.close_connections()
+        self.httpd.server_close()
+        return drained
+
+
+class _PooledRequestHandler(WSGIRequestHandler):
+    """
+    Request handler exposing the client socket to the app.
+
+    werkzeug answers every request with Connection: close, so each
+    connection carries a single request.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    # A client that sends nothing or stops reading for this long gives its
+    # worker back; generous, so a stalled phone can still pick up again
+    timeout = 120
+
+    def make_environ(self):
+        environ = super().make_environ()
+        # Lets the app hand regular files to the kernel with sendfile
+        environ[SOCKET_ENVIRON_KEY] = self.connection
+        return environ
+
+
+class _PooledWSGIServer(_ConnectionTrackingMixIn, BaseWSGIServer):
+    """WSGI server handing connections to a fixed pool of worker threads."""
+
+    multithread = True
+
+    def __init__(self, host: str, port: int, app, workers: int, max_connections: int, fd=None):
+        # werkzeug calls server_close while setting up, before the pool exists
+        self._executor = None
+        super().__init__(host, port, app, handler=_PooledRequestHandler, fd=fd)
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._slots = threading.BoundedSemaphore(max(workers, max_connections))
+        self._closing = False
+
+    def process_request(self, request, client_address):
+        # Backpressure: stop accepting while every connection slot is taken,
+        # so excess clients wait in the kernel backlog instead of piling up
+        while not self._slots.acquire(timeout=0.5):
+            if self._closing:
+                self.shutdown_request(request)
+                return
+        self._track(request)
+        self._executor.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def shutdown(self):
+        self._closing = True
+        super().shutdown()
+
+    def server_close(self):
+        self._closing = True
+        super().server_close()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+
+class PooledEngine(ServingEngine):
+    """
+    Fixed pool of worker threads with a connection limit.
+
+    Connections beyond the worker count queue for a free worker, up to
+    max_connections; beyond that the accept loop pauses. Shutdown stops
+    accepting first and then lets running transfers finish.
+    """
+
+    name = 'pool'
+
+    def __init__(self, app, host: str, port: int, **options):
+        super().__init__(app, host, port, **options)
+        self.httpd = _serve_on(_PooledWSGIServer, host, port, self.app, self.workers, self.max_connections)
+        self.port = self.httpd.port
+
+    def serve_forever(self):
+        self.httpd.serve_forever(poll_interval=SHUTDOWN_POLL_INTERVAL)
+
+    def shutdown(self, timeout: float = 10.0) -> bool:
+        self.httpd.shutdown()
+        drained = self.tracker.wait_idle(timeout)
+        self.httpd.close_connections()
+        self.httpd.server_close()
+        return drained
+
+
+ENGINES: Dict[str, Type[ServingEngine]] = {
+    WerkzeugEngine.name: WerkzeugEngine,
+    PooledEngine.name: PooledEngine,
+}
+
+
+def create_engine(name: str, app, host: str, port: int, **options) -> ServingEngine:
+    """Create and bind a serving engine by name."""
+    try:
+        engine_class = ENGINES[name]
+    except KeyError:
+        raise ValueError(f"Unknown engine '{name}'. Choose from: {', '.join(ENGINES)}")
+    return engine_class(app, host, port, **options)
@@ -0,0 +1,356 @@
+"""
+NullShare file index
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+from .listing import Listing
+from .utils import format_file_size
+
+# (arcname, size, mtime_ns) of one file below a shared folder
+Member = Tuple[str, int, int]
+
+
+class _DirState:
+    """What one directory looked like the last time it was scanned."""
+
+    __slots__ = ('mtime_ns', 'files', 'subdirs')
+
+    def __init__(self, mtime_ns: int, files: Dict[str, Tuple[int, int]], subdirs: List[str]):
+        self.mtime_ns = mtime_ns
+        self.files = files
+        self.subdirs = subdirs
+
+
+def _scan_dir(path: str) -> Optional[_DirState]:
+    """Scan a single directory level, or return None if it is gone."""
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+        files = {}
+        subdirs = []
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir():
+                        # Like os.walk, do not descend into symlinked folders
+                        if not entry.is_symlink():
+                            subdirs.append(entry.name)
+                    elif entry.is_file():
+                        st = entry.stat()
+                        files[entry.name] = (st.st_size, st.st_mtime_ns)
+                except OSError:
+                    continue
+    except OSError:
+        return None
+    subdirs.sort()
+    return _DirState(mtime_ns, files, subdirs)
+
+
+def _join(rel: str, name: str) -> str:
+    return f'{rel}/{name}' if rel else name
+
+
+class _FolderTree:
+    """Directory states of one shared folder, keyed by relative path."""
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.dirs: Dict[str, _DirState] = {}
+        self._sweep: Deque[str] = deque()
+        self._add_subtree('')
+
+    def _abs(self, rel: str) -> str:
+        return os.path.join(str(self.root), rel) if rel else str(self.root)
+
+    def _add_subtree(self, rel: str):
+        stack = [rel]
+        while stack:
+            current = stack.pop()
+            state = _scan_dir(self._abs(current))
+            if state is None:
+                continue
+            self.dirs[current] = state
+            stack.extend(_join(current, name) for name in state.subdirs)
+
+    def _remove_subtree(self, rel: str):
+        prefix = f'{rel}/' if rel else ''
+        for key in [k for k in self.dirs if k == rel or k.startswith(prefix)]:
+            del self.dirs[key]
+
+    def rescan(self, rel: str) -> bool:
+        """Rescan one directory level, adding or dropping whole subtrees."""
+        old = self.dirs.get(rel)
+        state = _scan_dir(self._abs(rel))
+        if state is None:
+            self._remove_subtree(rel)
+            return old is not None
+
+        self.dirs[rel] = state
+        old_subdirs = set(old.subdirs) if old else set()
+        for name in old_subdirs - set(state.subdirs):
+            self._remove_subtree(_join(rel, name))
+        for name in state.subdirs:
+            if name not in old_subdirs:
+                self._add_subtree(_join(rel, name))
+        return old is None or old.files != state.files or old.subdirs != state.subdirs
+
+    def check(self, sweep_budget: int) -> bool:
+        """
+        Bring the tree up to date.
+
+        Directories whose mtime changed are rescanned, which catches files
+        being added, removed or renamed. Files edited in place do not touch
+        their directory, so a rotating sweep also rescans unchanged directories
+        until about sweep_budget files have been looked at.
+        """
+        changed = False
+        for rel in list(self.dirs):
+            state = self.dirs.get(rel)
+            if state is None:
+                continue
+            try:
+                mtime_ns = os.stat(self._abs(rel)).st_mtime_ns
+            except OSError:
+                mtime_ns = None
+            if mtime_ns != state.mtime_ns:
+                changed = self.rescan(rel) or changed
+
+        seen = 0
+        while seen < sweep_budget:
+            if not self._sweep:
+                self._sweep.extend(self.dirs)
+                if not self._sweep:
+                    break
+            rel = self._sweep.popleft()
+            state = self.dirs.get(rel)
+            if state is None:
+                continue
+            seen += len(state.files) + 1
+            changed = self.rescan(rel) or changed
+            if not self._sweep:
+                break
+        return changed
+
+    def iter_members(self) -> Iterator[Member]:
+        """Yield files in the same order as archive.iter_folder_files."""
+        stack = ['']
+        while stack:
+            rel = stack.pop()
+            state = self.dirs.get(rel)
+            if state is None:
+                continue
+            for name in sorted(state.files):
+                size, mtime_ns = state.files[name]
+                yield _join(rel, name), size, mtime_ns
+            stack.extend(_join(rel, name) for name in reversed(state.subdirs))
+
+
+class FolderSnapshot:
+    """Immutable view of a shared folder at one index version."""
+
+    __slots__ = ('members', 'total_size', 'file_count', '_fingerprint')
+
+    def __init__(self, members: List[Member]):
+        self.members = members
+        self.total_size = sum(m[1] for m in members)
+        self.file_count = len(members)
+        self._fingerprint: Optional[str] = None
+
+    @property
+    def fingerprint(self) -> str:
+        """Digest of every member's name, size and mtime."""
+        if self._fingerprint is None:
+            digest = hashlib.sha1()
+            for arcname, size, mtime_ns in self.members:
+                digest.update(f'{arcname}\0{size}\0{mtime_ns}\n'.encode('utf-8', 'surrogateescape'))
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+
+
+class FileIndex:
+    """
+    In-process index of everything being shared.
+
+    The tree is walked once at startup. After that refresh() only rescans
+    directories that changed, and readers get prebuilt listings, so serving
+    the index page or a status poll does not touch the disk.
+    """
+
+    def __init__(self, paths: List[Path], zip_folders: bool = True,
+                 interval: float = 2.0, sweep_budget: int = 2000,
+                 archive_suffix: str = '.zip'):
+        self.paths = paths
+        self.zip_folders = zip_folders
+        self.archive_suffix = archive_suffix
+        self.interval = interval
+        self.sweep_budget = sweep_budget
+        self.version = 0
+        self.updated_at = time.time()
+        self.build_seconds = 0.0
+
+        self._lock = threading.Lock()
+        self._trees: Dict[Path, _FolderTree] = {}
+        self._file_stats: Dict[Path, Optional[Tuple[int, int]]] = {}
+        self._folders: Dict[Path, FolderSnapshot] = {}
+        self._files_info: List[Dict[str, Any]] = []
+        self._routes: Dict[str, Path] = {}
+        self._listing: Optional[Listing] = None
+        self._stop_event = threading.Event()
+        self._watcher: Optional[threading.Thread] = None
+
+        started = time.perf_counter()
+        with self._lock:
+            for path in self.paths:
+                if path.is_dir():
+                    self._trees[path] = _FolderTree(path)
+                    self._folders[path] = FolderSnapshot(list(self._trees[path].iter_members()))
+                else:
+                    self._file_stats[path] = self._stat_file(path)
+            self._publish()
+        self.build_seconds = time.perf_counter() - started
+
+    @staticmethod
+    def _stat_file(path: Path) -> Optional[Tuple[int, int]]:
+        try:
+            st = path.stat()
+        except OSError:
+            return None
+        return st.st_size, st.st_mtime_ns
+
+    def refresh(self) -> bool:
+        """Pick up changes on disk. Returns True if the listing changed."""
+        started = time.perf_counter()
+        with self._lock:
+            changed = False
+            for path in list(self._file_stats):
+                current = self._stat_file(path)
+                if current != self._file_stats[path]:
+                    self._file_stats[path] = current
+                    changed = True
+
+            folders = dict(self._folders)
+            for path, tree in self._trees.items():
+                if tree.check(self.sweep_budget):
+                    folders[path] = FolderSnapshot(list(tree.iter_members()))
+                    changed = True
+
+            if changed:
+                self._folders = folders
+                self._publish()
+                self.build_seconds = time.perf_counter() - started
+            return changed
+
+    def rescan_folder(self, path: Path) -> bool:
+        """
+        Rescan every directory of one shared folder now.
+
+        Used when a member is known to have changed, since an edit in place
+        may otherwise wait for the rotating sweep. Returns True if the
+        listing changed.
+        """
+        started = time.perf_counter()
+        with self._lock:
+            tree = self._trees.get(path)
+            if tree is None:
+                return False
+            changed = False
+            for rel in list(tree.dirs):
+                if rel in tree.dirs:
+                    changed = tree.rescan(rel) or changed
+            if changed:
+                self._folders = {**self._folders, path: FolderSnapshot(list(tree.iter_members()))}
+                self._publish()
+                self.build_seconds = time.perf_counter() - started
+            return changed
+
+    def _publish(self):
+        """Rebuild the listing and URL map from the current snapshots."""
+        files_info = []
+        routes: Dict[str, Path] = {}
+        for path in self.paths:
+            if path in self._file_stats:
+                stat = self._file_stats[path]
+                if stat is None:
+                    continue
+                routes.setdefault(path.name, path)
+                files_info.append({
+                    'name': path.name,
+                    'size': stat[0],
+                    'size_human': format_file_size(stat[0]),
+                    'type': 'file',
+                    'url': f'/download/{path.name}'
+                })
+            elif path in self._folders:
+                snapshot = self._folders[path]
+                if self.zip_folders:
+                    archive_name = f'{path.name}{self.archive_suffix}'
+                    routes.setdefault(archive_name, path)
+                    files_info.append({
+                        'name': archive_name,
+                        'size': snapshot.total_size,
+                        'size_human': format_file_size(snapshot.total_size),
+                        'type': 'folder',
+                        'url': f'/download/{archive_name}',
+                        'file_count': snapshot.file_count
+                    })
+                else:
+                    for arcname, size, _ in snapshot.members:
+                        files_info.append({
+                            'name': arcname,
+                            'size': size,
+                            'size_human': format_file_size(size),
+                            'type': 'file',
+                            'url': f'/download/{arcname}'
+                        })
+                # Files inside a folder stay reachable by their relative path
+                for arcname, _, _ in snapshot.members:
+                    routes.setdefault(arcname, path / arcname)
+        self._files_info = files_info
+        self._routes = routes
+        self.updated_at = time.time()
+        self.version += 1
+
+    def files_info(self) -> List[Dict[str, Any]]:
+        """Current listing. The returned list must not be modified."""
+        return self._files_info
+
+    def listing(self) -> Listing:
+        """Paginated, sortable view of the current listing."""
+        listing = self._listing
+        version = self.version
+        if listing is None or listing.version != version:
+            listing = Listing(self._files_info, version)
+            self._listing = listing
+        return listing
+
+    def resolve(self, name: str) -> Optional[Path]:
+        """Map the name part of a /download/ URL to the shared path."""
+        return self._routes.get(name)
+
+    def folder(self, path: Path) -> Optional[FolderSnapshot]:
+        """Current snapshot of a shared folder."""
+        return self._folders.get(path)
+
+    def _watch(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Warning: Could not refresh file index: {e}")
+
+    def start_watching(self):
+        """Refresh the index from a background thread every interval seconds."""
+        if self._watcher and self._watcher.is_alive():
+            return
+        self._stop_event.clear()
+        self._watcher = threading.Thread(target=self._watch, daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self):
+        """Stop the background refresh thread."""
+        self._stop_event.set()
@@ -0,0 +1,208 @@
+"""
+NullShare paginated file listing
+"""
+import base64
+import json
+import threading
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from .utils import format_file_size
+
+SORT_FIELDS = ('name', 'size')
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+Entry = Dict[str, Any]
+
+
+def encode_cursor(key: Tuple) -> str:
+    """Turn the sort key of the last returned entry into an opaque cursor."""
+    data = json.dumps(list(key), separators=(',', ':'), ensure_ascii=False)
+    return base64.urlsafe_b64encode(data.encode('utf-8', 'surrogatepass')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple:
+    """Inverse of encode_cursor. Raises ValueError for anything it did not produce."""
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        key = json.loads(data.decode('utf-8', 'surrogatepass'))
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(key, list) or not key:
+        raise ValueError("Invalid cursor")
+    return tuple(key)
+
+
+def _sort_key(entry: Entry, sort: str) -> Tuple:
+    # Directories come first, then entries by the requested field; the path
+    # breaks ties so every entry has a distinct position
+    rank = 0 if entry['type'] == 'directory' else 1
+    name = entry['name']
+    if sort == 'size':
+        return (rank, entry['size'], name.casefold(), entry['path'])
+    return (rank, name.casefold(), name, entry['path'])
+
+
+class _View:
+    """Entries of one directory and filter, in ascending sort order."""
+
+    __slots__ = ('items', 'keys')
+
+    def __init__(self, items: List[Entry], keys: List[Tuple]):
+        self.items = items
+        self.keys = keys
+
+
+class Listing:
+    """
+    Queryable listing of one file index version.
+
+    Directory trees and sorted views are built on first use and kept, so
+    paging through a listing costs a bisect and a slice however large the
+    share is.
+    """
+
+    def __init__(self, entries: List[Entry], version: int, max_views: int = 32):
+        self.version = version
+        self.max_views = max_views
+        self._entries = [dict(entry, path=entry['name']) for entry in entries]
+        self._children: Optional[Dict[str, List[Entry]]] = None
+        self._views: 'OrderedDict[Tuple, _View]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _build_tree(self) -> Dict[str, List[Entry]]:
+        """Group entries by parent directory, adding an entry per subdirectory."""
+        children: Dict[str, List[Entry]] = {'': []}
+        directories: Dict[str, Entry] = {}
+        for entry in self._entries:
+            path = entry['path']
+            parent, _, name = path.rpartition('/')
+            children.setdefault(parent, []).append(dict(entry, name=name))
+
+            # Account the file in every directory above it
+            while parent:
+                directory = directories.get(parent)
+                if directory is None:
+                    grandparent, _, dir_name = parent.rpartition('/')
+                    directory = {
+                        'name': dir_name,
+                        'path': parent,
+                        'size': 0,
+                        'type': 'directory',
+                        'url': None,
+                        'file_count': 0
+                    }
+                    directories[parent] = directory
+                    children.setdefault(grandparent, []).append(directory)
+                    children.setdefault(parent, [])
+                directory['size'] += entry['size']
+                directory['file_count'] += 1
+                parent = parent.rpartition('/')[0]
+
+        for directory in directories.values():
+            directory['size_human'] = format_file_size(directory['size'])
+        return children
+
+    def _view(self, directory: Optional[str], prefix: str, sort: str) -> _View:
+        cache_key = (directory, prefix, sort)
+        with self._lock:
+            view = self._views.get(cache_key)
+            if view is not None:
+                self._views.move_to_end(cache_key)
+                return view
+
+            if directory is None:
+                items = self._entries
+            else:
+                if self._children is None:
+                    self._children = self._build_tree()
+                items = self._children.get(directory)
+                if items is None:
+                    raise KeyError(directory)
+            if prefix:
+                folded = prefix.casefold()
+                items = [entry for entry in items if entry['name'].casefold().startswith(folded)]
+
+            pairs = sorted(((_sort_key(entry, sort), entry) for entry in items), key=lambda pair: pair[0])
+            view = _View([entry for _, entry in pairs], [key for key, _ in pairs])
+            self._views[cache_key] = view
+            while len(self._views) > self.max_views:
+                self._views.popitem(last=False)
+            return view
+
+    def page(self, directory: Optional[str] = None, prefix: str = '', sort: str = 'name',
+             descending: bool = False, cursor: Optional[str] = None,
+             offset: Optional[int] = None, limit: int = DEFAULT_PAGE_SIZE) -> Dict[str, Any]:
+        """
+        Return one page of the listing.
+
+        Args:
+            directory: Only list the direct children of this directory, with
+                subdirectories as entries; '' is the top level. None lists
+                every entry flat.
+            prefix: Only entries whose name starts with this, ignoring case
+            sort: 'name' or 'size'
+            descending: Reverse the sort order
+            cursor: Continue after the entry this cursor was issued for
+            offset: Start at this position instead; for jumping around
+            limit: Maximum number of entries to return
+
+        Raises:
+            ValueError: For an unknown sort field or a malformed cursor
+            KeyError: If the directory does not exist
+
+        Returns:
+            Dictionary with the entries, the total number of matches and
+            the cursor of the next page, or None on the last page
+        """
+        if sort not in SORT_FIELDS:
+            raise ValueError(f"Unknown sort field '{sort}'. Choose from: {', '.join(SORT_FIELDS)}")
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        view = self._view(directory, prefix, sort)
+        total = len(view.items)
+
+        if cursor is not None:
+            key = decode_cursor(cursor)
+            try:
+                if descending:
+                    end = bisect_left(view.keys, key)
+                    start = max(0, end - limit)
+                else:
+                    start = bisect_right(view.keys, key)
+                    end = min(total, start + limit)
+            except TypeError:
+                raise ValueError("Invalid cursor")
+        else:
+            position = max(0, offset or 0)
+            if descending:
+                end = max(0, total - position)
+                start = max(0, end - limit)
+            else:
+                start = min(total, position)
+                end = min(total, start + limit)
+
+        items = view.items[start:end]
+        keys = view.keys[start:end]
+        if descending:
+            items = items[::-1]
+            keys = keys[::-1]
+            more = start > 0
+        else:
+            more = end < total
+        position = total - end if descending else start
+
+        return {
+            'version': self.version,
+            'directory': directory,
+            'sort': sort,
+            'order': 'desc' if descending else 'asc',
+            'total': total,
+            'offset': position,
+            'items': items,
+            'next_cursor': encode_cursor(keys[-1]) if more and keys else None
+        }
@@ -0,0 +1,112 @@
+"""
+NullShare Prometheus metrics exposition
+"""
+import time
+from typing import List, Optional
+
+from .stats import Histogram, ServerStats
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _header(lines: List[str], name: str, kind: str, help_text: str):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} {kind}')
+
+
+def _histogram(lines: List[str], name: str, help_text: str, histogram: Histogram):
+    _header(lines, name, 'histogram', help_text)
+    cumulative, total, count = histogram.collect()
+    bounds = list(histogram.buckets) + [float('inf')]
+    for bound, value in zip(bounds, cumulative):
+        lines.append(f'{name}_bucket{{le="{_format(bound)}"}} {value}')
+    lines.append(f'{name}_sum {_format(total)}')
+    lines.append(f'{name}_count {count}')
+
+
+def render_metrics(stats: ServerStats, files_count: int,
+                   index_build_seconds: Optional[float] = None,
+                   archive_cache_bytes: Optional[int] = None,
+                   queued_transfers: Optional[int] = None) -> str:
+    """
+    Render server statistics in the Prometheus text exposition format.
+
+    Args:
+        stats: Statistics of the running server
+        files_count: Number of entries in the current listing
+        index_build_seconds: Duration of the last file index rebuild
+        archive_cache_bytes: Disk used by cached folder archives, if caching
+        queued_transfers: Downloads waiting for a slot, if transfers are limited
+
+    Returns:
+        Metrics text, one sample per line
+    """
+    lines: List[str] = []
+
+    _header(lines, 'nullshare_uptime_seconds', 'gauge', 'Seconds since the server started.')
+    lines.append(f'nullshare_uptime_seconds {_format(round(time.time() - stats.start_time.timestamp(), 3))}')
+
+    _header(lines, 'nullshare_files', 'gauge', 'Entries in the shared file listing.')
+    lines.append(f'nullshare_files {files_count}')
+
+    _header(lines, 'nullshare_requests_total', 'counter', 'HTTP requests received.')
+    lines.append(f'nullshare_requests_total {stats.total_requests}')
+
+    _header(lines, 'nullshare_downloads_total', 'counter', 'Downloads started.')
+    lines.append(f'nullshare_downloads_total {stats.total_downloads}')
+
+    _header(lines, 'nullshare_unique_clients', 'gauge', 'Distinct client addresses seen.')
+    lines.append(f'nullshare_unique_clients {stats.unique_clients}')
+
+    _header(lines, 'nullshare_active_transfers', 'gauge', 'Download responses currently being sent.')
+    lines.append(f'nullshare_active_transfers {stats.active_transfers.value}')
+
+    if queued_transfers is not None:
+        _header(lines, 'nullshare_queued_transfers', 'gauge', 'Downloads waiting for a transfer slot.')
+        lines.append(f'nullshare_queued_transfers {queued_transfers}')
+
+    _header(lines, 'nullshare_rejected_transfers_total', 'counter', 'Downloads turned away with 503 because the server was busy.')
+    lines.append(f'nullshare_rejected_transfers_total {stats.rejected_transfers.value}')
+
+    _header(lines, 'nullshare_bytes_sent_total', 'counter', 'Response body bytes sent, per file.')
+    for name, value in sorted(stats.bytes_sent.values().items()):
+        lines.append(f'nullshare_bytes_sent_total{{file="{_escape(name)}"}} {value}')
+
+    _histogram(lines, 'nullshare_request_duration_seconds',
+               'Time from request start until the response was closed.', stats.request_duration)
+    _histogram(lines, 'nullshare_time_to_first_byte_seconds',
+               'Time from request start until the first body bytes of a download.', stats.time_to_first_byte)
+    _histogram(lines, 'nullshare_download_throughput_bytes_per_second',
+               'Average throughput of each download.', stats.download_throughput)
+    _histogram(lines, 'nullshare_archive_build_seconds',
+               'Time to build a complete folder archive.', stats.archive_build)
+    _header(lines, 'nullshare_archive_cache_hits_total', 'counter', 'Folder archives sent from the cache.')
+    lines.append(f'nullshare_archive_cache_hits_total {stats.archive_cache_hits.value}')
+
+    _header(lines, 'nullshare_archive_cache_misses_total', 'counter', 'Folder archives that had to be built.')
+    lines.append(f'nullshare_archive_cache_misses_total {stats.archive_cache_misses.value}')
+
+    if archive_cache_bytes is not None:
+        _header(lines, 'nullshare_archive_cache_bytes', 'gauge', 'Disk space used by cached folder archives.')
+        lines.append(f'nullshare_archive_cache_bytes {archive_cache_bytes}')
+
+    _histogram(lines, 'nullshare_listing_render_seconds',
+               'Time to render the file listing page.', stats.listing_render)
+
+    if index_build_seconds is not None:
+        _header(lines, 'nullshare_index_build_seconds', 'gauge', 'Duration of the last file index rebuild.')
+        lines.append(f'nullshare_index_build_seconds {_format(round(index_build_seconds, 6))}')
+
+    return '\n'.join(lines) + '\n'
@@ -3,12 +3,15 @@ NullShare QR Code generation and display
 """
 import qrcode
 from qrcode.constants import ERROR_CORRECT_L, ERROR_CORRECT_M, ERROR_CORRECT_Q, ERROR_CORRECT_H
-from typing import Optional, Dict, Any
+from functools import lru_cache
+from typing import Optional, Dict, Any, List, Tuple
 import sys
 import os
 import io
+import operator
+import re
 import click
-from PIL import Image
+from PIL import Image, ImageOps
 
 # Error correction levels mapping
 ERROR_LEVELS = {
@@ -18,6 +21,95 @@ ERROR_LEVELS = {
     'H': ERROR_CORRECT_H,  # 30% correction
 }
 
+# Encoded matrices kept, per URL and error correction level
+MATRIX_CACHE_SIZE = 32
+
+# Quiet zone of the image outputs, in modules
+IMAGE_BORDER = 4
+
+# Rendered images kept, per URL and size
+IMAGE_CACHE_SIZE = 16
+
+# One matrix row as bytes: 1 for a dark module, 0 for a light one
+Matrix = Tuple[bytes, ...]
+
+# Each module is two characters wide, so it comes out roughly square
+_FULL_BLOCKS = {0: '  ', 1: '██'}
+
+# Two module rows per line: top row worth 2, bottom row worth 1
+_HALF_BLOCKS = {0: ' ', 1: '▄', 2: '▀', 3: '█'}
+_DOUBLE = bytes([0, 2]) + bytes(254)
+
+_FRAME_CHARS = '┌┐└┘─│'
+_BLOCK_RUN = re.compile('█+')
+_FRAME_RUN = re.compile(f'[{_FRAME_CHARS}]+')
+
+
+@lru_cache(maxsize=MATRIX_CACHE_SIZE)
+def _encode(url: str, error_correction: str) -> Matrix:
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=ERROR_LEVELS[error_correction],
+        border=0,
+    )
+    qr.add_data(url)
+    qr.make(fit=True)
+    return tuple(bytes(row) for row in qr.get_matrix())
+
+
+def qr_matrix(url: str, error_correction: str = 'L', border: int = 0) -> Matrix:
+    """
+    Modules of the QR code for url, with border light modules around them.
+    
+    Encoding is the expensive part, so the matrix is cached and every
+    renderer, terminal or image, starts from the same one.
+    
+    Args:
+        url: The URL to encode
+        error_correction: Error correction level (L, M, Q, H)
+        border: Quiet zone to add, in modules
+    
+    Returns:
+        Tuple of rows, one bytes object per row
+    """
+    if not url:
+        raise ValueError("URL cannot be empty")
+    level = error_correction.upper()
+    matrix = _encode(url, level if level in ERROR_LEVELS else 'L')
+    if not border:
+        return matrix
+    width = len(matrix[0]) + 2 * border
+    blank = bytes(width)
+    side = bytes(border)
+    return (blank,) * border + tuple(side + row + side for row in matrix) + (blank,) * border
+
+
+def _render_rows(matrix: Matrix, cells: Dict[int, str]) -> List[str]:
+    """Turn each matrix row into text through a translate table."""
+    return [row.decode('latin-1').translate(cells) for row in matrix]
+
+
+def _framed(lines: List[str], padding: int) -> List[str]:
+    """Put rendered rows in a box, padding spaces and lines inside it."""
+    width = len(lines[0]) + 2 * padding
+    side = ' ' * padding
+    blank = '│' + ' ' * width + '│'
+    return (
+        ['┌' + '─' * width + '┐']
+        + [blank] * padding
+        + ['│' + side + line + side + '│' for line in lines]
+        + [blank] * padding
+        + ['└' + '─' * width + '┘']
+    )
+
+
+def _colorize(text: str, fg_code: str, bg_code: str = '') -> str:
+    """Wrap each run of blocks, and of frame characters, in one escape code."""
+    block_style = f'\033[{fg_code};{bg_code}m' if bg_code else f'\033[{fg_code}m'
+    text = _BLOCK_RUN.sub(lambda match: f'{block_style}{match.group()}\033[0m', text)
+    # Borders in cyan
+    return _FRAME_RUN.sub(lambda match: f'\033[36m{match.group()}\033[0m', text)
+
 
 def generate_qr_terminal(url: str, box_size: int = 1, border: int = 1) -> str:
     """
@@ -32,40 +124,33 @@ def generate_qr_terminal(url: str, box_size: int = 1, border: int = 1) -> str:
     Returns:
         ASCII representation of QR code
     """
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=ERROR_CORRECT_L,
-        box_size=box_size,
-        border=border,
-    )
-    qr.add_data(url)
-    qr.make(fit=True)
-    
-    qr_matrix = qr.get_matrix()
-    qr_text = ""
-    
-    # Top border
-    qr_text += "┌" + "─" * (len(qr_matrix[0]) + border * 2) + "┐\n"
-    
-    # Add top padding
-    for _ in range(border):
-        qr_text += "│" + " " * (len(qr_matrix[0]) + border * 2) + "│\n"
-    
-    # QR content
-    for row in qr_matrix:
-        qr_text += "│" + " " * border
-        for bit in row:
-            qr_text += "██" if bit else "  "
-        qr_text += " " * border + "│\n"
+    lines = _render_rows(qr_matrix(url, border=border), _FULL_BLOCKS)
+    return '\n'.join(_framed(lines, border))
+
+
+def generate_qr_terminal_compact(url: str, border: int = 1) -> str:
+    """
+    Generate a compact QR code for the terminal using half-block characters.
     
-    # Add bottom padding
-    for _ in range(border):
-        qr_text += "│" + " " * (len(qr_matrix[0]) + border * 2) + "│\n"
+    Each character covers one module across and two module rows, so the
+    code takes half the lines of generate_qr_terminal and about a quarter
+    of the bytes. Fits small terminals and is quick to print over SSH.
     
-    # Bottom border
-    qr_text += "└" + "─" * (len(qr_matrix[0]) + border * 2) + "┘"
+    Args:
+        url: The URL to encode in the QR code
+        border: Quiet zone around the code, in modules (default: 1)
     
-    return qr_text
+    Returns:
+        Text representation of the QR code
+    """
+    matrix = qr_matrix(url, border=border)
+    if len(matrix) % 2:
+        matrix += (bytes(len(matrix[0])),)
+    pairs = tuple(
+        bytes(map(operator.add, top.translate(_DOUBLE), bottom))
+        for top, bottom in zip(matrix[::2], matrix[1::2])
+    )
+    return '\n'.join(_render_rows(pairs, _HALF_BLOCKS))
 
 
 def generate_colored_qr_terminal(
@@ -112,26 +197,17 @@ def generate_colored_qr_terminal(
     fg_code = colors[color]
     bg_code = f'48;5;232' if bg_color == 'black' else ''
     
-    qr_text = generate_qr_terminal(url, box_size=box_size)
-    
-    # Colorize the QR code
-    colored_lines = []
-    for line in qr_text.split('\n'):
-        colored_line = ""
-        for char in line:
-            if char == '█':
-                if bg_code:
-                    colored_line += f'\033[{fg_code};{bg_code}m{char}\033[0m'
-                else:
-                    colored_line += f'\033[{fg_code}m{char}\033[0m'
-            elif char in ('┌', '┐', '└', '┘', '─', '│'):
-                # Borders in cyan
-                colored_line += f'\033[36m{char}\033[0m'
-            else:
-                colored_line += char
-        colored_lines.append(colored_line)
-    
-    return '\n'.join(colored_lines)
+    return _colorize(generate_qr_terminal(url, box_size=box_size), fg_code, bg_code)
+
+
+def _matrix_image(matrix: Matrix, size: int, fill_color: str, back_color: str) -> Image.Image:
+    """Draw a matrix as a size x size RGB image with sharp module edges."""
+    width = len(matrix)
+    # 0 is dark, 255 light, one pixel per module
+    pixels = b''.join(matrix).translate(bytes([255, 0]) + bytes(254))
+    img = Image.frombytes('L', (width, width), pixels)
+    img = ImageOps.colorize(img, black=fill_color, white=back_color)
+    return img.resize((size, size), Image.Resampling.NEAREST)
 
 
 def generate_qr_image(
@@ -164,27 +240,8 @@ def generate_qr_image(
         raise ValueError("URL cannot be empty")
     
     try:
-        # Get error correction level
-        ec_level = ERROR_LEVELS.get(error_correction.upper(), ERROR_CORRECT_L)
-        
-        # Create QR code
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=ec_level,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(url)
-        qr.make(fit=True)
-        
-        # Generate image
-        img = qr.make_image(
-            fill_color=fill_color,
-            back_color=back_color
-        )
-        
-        # Resize to requested size
-        img = img.resize((size, size), Image.Resampling.LANCZOS)
+        img = _matrix_image(qr_matrix(url, error_correction, border=IMAGE_BORDER),
+                            size, fill_color, back_color)
         
         # Add logo if specified
         if logo_path and os.path.exists(logo_path):
@@ -248,6 +305,52 @@ def generate_qr_image_to_bytes(
     return buffer.getvalue()
 
 
+def generate_qr_svg(
+    url: str,
+    fill_color: str = "black",
+    back_color: str = "white",
+    error_correction: str = "L"
+) -> str:
+    """
+    Generate QR code as an SVG document that scales to any size.
+    
+    Args:
+        url: URL to encode
+        fill_color: QR code color
+        back_color: Background color
+        error_correction: Error correction level (L, M, Q, H)
+    
+    Returns:
+        SVG markup
+    """
+    matrix = qr_matrix(url, error_correction, border=IMAGE_BORDER)
+    width = len(matrix)
+    # One rectangle per horizontal run of dark modules
+    path = []
+    for y, row in enumerate(matrix):
+        for match in re.finditer(b'\x01+', row):
+            run = match.end() - match.start()
+            path.append(f'M{match.start()} {y}h{run}v1h-{run}z')
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {width} {width}" '
+        f'shape-rendering="crispEdges">'
+        f'<rect width="{width}" height="{width}" fill="{back_color}"/>'
+        f'<path fill="{fill_color}" d="{"".join(path)}"/></svg>\n'
+    )
+
+
+@lru_cache(maxsize=IMAGE_CACHE_SIZE)
+def qr_png(url: str, size: int = 400) -> bytes:
+    """PNG of the QR code for url, rendered once per URL and size."""
+    return generate_qr_image_to_bytes(url, size=size)
+
+
+@lru_cache(maxsize=IMAGE_CACHE_SIZE)
+def qr_svg(url: str) -> bytes:
+    """SVG of the QR code for url, rendered once per URL."""
+    return generate_qr_svg(url).encode('utf-8')
+
+
 def display_qr_in_terminal(
     url: str,
     show_instructions: bool = True,
@@ -299,24 +402,7 @@ def generate_qr_for_clipboard(url: str) -> str:
         ASCII QR code text
     """
     try:
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=ERROR_CORRECT_L,
-            box_size=1,
-            border=0,
-        )
-        qr.add_data(url)
-        qr.make(fit=True)
-        
-        qr_matrix = qr.get_matrix()
-        qr_text = ""
-        
-        for row in qr_matrix:
-            for bit in row:
-                qr_text += "██" if bit else "  "
-            qr_text += "\n"
-        
-        return qr_text
+        return ''.join(line + '\n' for line in _render_rows(qr_matrix(url), _FULL_BLOCKS))
         
     except Exception as e:
         return f"[QR Code Error: {e}]"
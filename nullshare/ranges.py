@@ -0,0 +1,248 @@
+"""
+NullShare HTTP range and conditional request helpers
+"""
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+# Anything above this is almost certainly not a resuming client
+MAX_RANGES = 16
+
+CHUNK_SIZE = 64 * 1024
+
+ByteRange = Tuple[int, int]
+
+
+def parse_range(header: Optional[str], length: int,
+                max_ranges: int = MAX_RANGES) -> Optional[List[ByteRange]]:
+    """
+    Parse a Range header against a representation of the given length.
+
+    Args:
+        header: Value of the Range header
+        length: Total length of the representation
+        max_ranges: Ignore headers asking for more ranges than this
+
+    Returns:
+        Sorted, coalesced list of inclusive (start, end) ranges, an empty list
+        when no range is satisfiable, or None when the header should be
+        ignored and the full representation sent.
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or not spec:
+        return None
+
+    specs = [s.strip() for s in spec.split(',') if s.strip()]
+    if not specs or len(specs) > max_ranges:
+        return None
+
+    ranges = []
+    for item in specs:
+        first, sep, last = item.partition('-')
+        first, last = first.strip(), last.strip()
+        if not sep or (first and not first.isdigit()) or (last and not last.isdigit()):
+            return None
+        if not first:
+            if not last:
+                return None
+            # Suffix range: the final N bytes
+            suffix = int(last)
+            if suffix == 0 or length == 0:
+                continue
+            ranges.append((max(0, length - suffix), length - 1))
+            continue
+        start = int(first)
+        end = int(last) if last else length - 1
+        if last and end < start:
+            return None
+        if start >= length:
+            continue
+        ranges.append((start, min(end, length - 1)))
+
+    ranges.sort()
+    merged: List[ByteRange] = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def etag_matches(header: Optional[str], etag: str, weak: bool = True) -> bool:
+    """Check an If-Match/If-None-Match style list against an ETag."""
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    for candidate in header.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            if not weak:
+                continue
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def http_date(timestamp: float) -> str:
+    """Format a POSIX timestamp as an HTTP date."""
+    return formatdate(timestamp, usegmt=True)
+
+
+def _parse_http_date(value: str) -> Optional[float]:
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def not_modified_since(header: Optional[str], mtime: float) -> bool:
+    """True if an If-Modified-Since header shows the client copy is current."""
+    if not header:
+        return False
+    since = _parse_http_date(header)
+    return since is not None and int(mtime) <= since
+
+
+def if_range_matches(header: Optional[str], etag: str, mtime: Optional[float]) -> bool:
+    """
+    Evaluate If-Range.
+
+    An entity tag must match strongly, a date must equal Last-Modified.
+    Without an If-Range header the Range header always applies.
+    """
+    if not header:
+        return True
+    header = header.strip()
+    if header.startswith('"') or header.startswith('W/'):
+        return etag_matches(header, etag, weak=False)
+    if mtime is None:
+        return False
+    since = _parse_http_date(header)
+    return since is not None and since == int(mtime)
+
+
+def content_range(byte_range: ByteRange, length: int) -> str:
+    """Format a Content-Range value."""
+    return f'bytes {byte_range[0]}-{byte_range[1]}/{length}'
+
+
+def iter_file_ranges(path: Path, ranges: List[ByteRange],
+                     chunk_size: int = CHUNK_SIZE) -> Iterator[Tuple[int, bytes]]:
+    """Yield (range index, data) pieces of a regular file."""
+    with open(path, 'rb') as f:
+        for index, (start, end) in enumerate(ranges):
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                data = f.read(min(chunk_size, remaining))
+                if not data:
+                    return
+                remaining -= len(data)
+                yield index, data
+
+
+def iter_sendfile_ranges(sock, path: Path, ranges: List[ByteRange],
+                         on_sent: Optional[Callable[[int], None]] = None,
+                         throttle: Optional[Callable[[int], None]] = None,
+                         chunk_size: int = CHUNK_SIZE) -> Iterator[Tuple[int, bytes]]:
+    """
+    Send ranges of a regular file straight from the kernel with sendfile.
+
+    Yields an empty piece before each range so the WSGI server writes the
+    status line, headers and any multipart boundary first; the data itself
+    then goes out on the raw socket when the generator is resumed. Bytes
+    sent this way are reported to on_sent, since they never pass through
+    the response iterator. With a throttle the range is sent in chunk_size
+    pieces, each one waiting for its turn.
+    """
+    with open(path, 'rb') as f:
+        for index, (start, end) in enumerate(ranges):
+            yield index, b''
+            offset = start
+            remaining = end - start + 1
+            while remaining > 0:
+                count = min(remaining, chunk_size) if throttle else remaining
+                if throttle:
+                    throttle(count)
+                sent = sock.sendfile(f, offset, count)
+                if on_sent:
+                    on_sent(sent)
+                if sent != count:
+                    raise OSError(f"File shrank while sending: {path}")
+                offset += sent
+                remaining -= sent
+
+
+def iter_stream_ranges(chunks: Iterable[bytes],
+                       ranges: List[ByteRange]) -> Iterator[Tuple[int, bytes]]:
+    """
+    Yield (range index, data) pieces cut from a sequential byte stream.
+
+    Ranges must be sorted and non-overlapping, as returned by parse_range.
+    The stream is consumed once and abandoned after the last range.
+    """
+    if not ranges:
+        return
+    offset = 0
+    index = 0
+    iterator = iter(chunks)
+    try:
+        for chunk in iterator:
+            chunk_end = offset + len(chunk)
+            while index < len(ranges):
+                start, end = ranges[index]
+                if start >= chunk_end:
+                    break
+                lo = max(start, offset) - offset
+                hi = min(end + 1, chunk_end) - offset
+                if hi > lo:
+                    yield index, chunk[lo:hi]
+                if end >= chunk_end:
+                    break
+                index += 1
+            offset = chunk_end
+            if index >= len(ranges):
+                return
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close:
+            close()
+
+
+def _part_header(boundary: str, content_type: str, byte_range: ByteRange, length: int) -> bytes:
+    return (f'\r\n--{boundary}\r\n'
+            f'Content-Type: {content_type}\r\n'
+            f'Content-Range: {content_range(byte_range, length)}\r\n\r\n').encode('latin-1')
+
+
+def multipart_length(ranges: List[ByteRange], length: int,
+                     content_type: str, boundary: str) -> int:
+    """Exact size of the multipart/byteranges body built by iter_multipart."""
+    total = len(f'\r\n--{boundary}--\r\n')
+    for byte_range in ranges:
+        total += len(_part_header(boundary, content_type, byte_range, length))
+        total += byte_range[1] - byte_range[0] + 1
+    return total
+
+
+def iter_multipart(pieces: Iterable[Tuple[int, bytes]], ranges: List[ByteRange],
+                   length: int, content_type: str, boundary: str) -> Iterator[bytes]:
+    """Wrap (range index, data) pieces into a multipart/byteranges body."""
+    current = -1
+    for index, data in pieces:
+        while current < index:
+            current += 1
+            yield _part_header(boundary, content_type, ranges[current], length)
+        yield data
+    yield f'\r\n--{boundary}--\r\n'.encode('latin-1')
+
+
+def file_etag(st: os.stat_result) -> str:
+    """Strong ETag for a regular file from its stat result."""
+    return f'"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}"'
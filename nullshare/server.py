@@ -3,21 +3,80 @@ NullShare HTTP Server
 """
 import os
 import sys
+import mimetypes
+from collections import OrderedDict
+from functools import partial
 from pathlib import Path
-from typing import List, Optional, Dict, Any
-import zipfile
-import io
+from typing import List, Optional, Dict, Any, Callable, Tuple
+from urllib.parse import quote
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import hashlib
 import secrets
+import socket
 
 try:
-    from flask import Flask, send_file, render_template, abort, request, jsonify
+    from flask import Flask, Response, render_template, abort, request, jsonify
+    from werkzeug.wsgi import ClosingIterator
 except ImportError:
     print("Error: Flask is not installed. Install it with: pip install flask")
     sys.exit(1)
 
+from .archive import (
+    ARCHIVE_FORMATS, ArchiveChanged, CompressionPolicy, available_formats, archive_etag,
+    iter_tar, iter_zip, iter_zstd, stored_zip_length, tar_length
+)
+from .admission import AdmissionController, ServerBusy
+from .cache import ArchiveCache
+from .compression import (
+    COMPRESSIBLE_TYPES, MIN_SIZE as MIN_COMPRESS_SIZE, EncodedBodyCache, compress, negotiate_encoding
+)
+from .engine import SOCKET_ENVIRON_KEY, ServingEngine, create_engine
+from .index import FileIndex
+from .listing import DEFAULT_PAGE_SIZE
+from .ranges import (
+    parse_range, etag_matches, if_range_matches, not_modified_since, http_date,
+    content_range, file_etag, iter_file_ranges, iter_sendfile_ranges, iter_stream_ranges,
+    iter_multipart, multipart_length
+)
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, render_metrics
+from .shaping import RateLimiter
+from .stats import ServerStats, Transfer
+
+# Pixel size limits of /qr.png
+QR_IMAGE_SIZE = 400
+QR_MIN_SIZE = 64
+QR_MAX_SIZE = 2048
+
+# Pool workers kept free for pages, status and QR codes while downloads
+# hold or wait for a transfer slot
+RESERVED_WORKERS = 8
+
+# Archive lengths remembered; older ETags belong to superseded snapshots
+ARCHIVE_LENGTHS_MAX = 64
+
+# WSGI environ key holding the perf_counter() value at request start
+REQUEST_START_KEY = 'nullshare.request_start'
+
+
+class _PassthroughResponse(Response):
+    """
+    Response for bodies handed to the server as they are.
+
+    Werkzeug returns a direct_passthrough body without wrapping it, which
+    skips the call_on_close callbacks; this wraps it so they run once the
+    server closes the body. Empty bodies (HEAD, 204, 304) are already
+    wrapped by werkzeug and are left alone.
+    """
+
+    def get_app_iter(self, environ):
+        app_iter = super().get_app_iter(environ)
+        if app_iter is self.response:
+            return ClosingIterator(app_iter, self._on_close)
+        return app_iter
+
 class ShareServer:
     """HTTP server for sharing files."""
     
@@ -29,7 +88,23 @@ class ShareServer:
         password: Optional[str] = None,
         timeout: Optional[int] = None,
         live_mode: bool = False,
-        one_time: bool = False
+        one_time: bool = False,
+        engine: str = 'pool',
+        workers: int = 32,
+        max_connections: int = 256,
+        drain_timeout: float = 10.0,
+        use_sendfile: bool = True,
+        zip_workers: Optional[int] = None,
+        zip_level: int = 6,
+        cache_size: int = 1024 * 1024 * 1024,
+        archive_format: str = 'zip',
+        max_rate: Optional[int] = None,
+        per_client_rate: Optional[int] = None,
+        max_transfers: int = 16,
+        queue_size: int = 8,
+        queue_timeout: float = 30.0,
+        announce: bool = False,
+        on_ready: Optional[Callable[['ShareServer'], None]] = None
     ):
         self.paths = paths
         self.port = port
@@ -38,18 +113,74 @@ class ShareServer:
         self.timeout = timeout
         self.live_mode = live_mode
         self.one_time = one_time
-        self.downloaded_files = set()
+        self.engine_name = engine
+        self.workers = workers
+        self.max_connections = max_connections
+        self.drain_timeout = drain_timeout
+        self.announce = announce
+        self.beacon = None
+        self.on_ready = on_ready
+        
+        # Set once the socket is listening, and once the server has stopped
+        self.ready = threading.Event()
+        self.stopped = threading.Event()
+        self._lifecycle_lock = threading.Lock()
+        self.use_sendfile = use_sendfile and hasattr(os, 'sendfile')
+        
+        # Default folder archive format; clients can ask for another one
+        if archive_format not in available_formats():
+            raise ValueError(f"Unsupported archive format '{archive_format}'. "
+                             f"Choose from: {', '.join(available_formats())}")
+        self.archive_format = archive_format
+        
+        # Folder archives are deflated in blocks on a shared pool
+        self.zip_workers = zip_workers or os.cpu_count() or 1
+        self._zip_pool = ThreadPoolExecutor(max_workers=self.zip_workers) if self.zip_workers > 1 else None
+        # Already compressed members are stored instead of deflated
+        self.zip_policy = CompressionPolicy(level=zip_level)
+        
+        # Index of shared files, walked once and refreshed in the background
+        self.file_index = FileIndex(paths, zip_folders=zip_folders,
+                                    archive_suffix=ARCHIVE_FORMATS[archive_format][0])
+        
+        # Lengths of folder archives that have been built completely, by
+        # ETag, least recently used first
+        self._archive_lengths: 'OrderedDict[str, int]' = OrderedDict()
+        self._archive_lengths_lock = threading.Lock()
+        
+        # Complete archives are kept on disk and served like regular files
+        self.archive_cache = ArchiveCache(cache_size) if cache_size > 0 else None
         
         # Generate access token if password is set
         self.access_token = secrets.token_urlsafe(16) if password else None
         
         # Statistics
-        self.stats = {
-            'start_time': datetime.now(),
-            'total_requests': 0,
-            'total_downloads': 0,
-            'clients': set()
-        }
+        self.stats = ServerStats()
+        
+        # Upload limits in bytes per second, shared fairly between downloads
+        self.rate_limiter = RateLimiter(max_rate=max_rate, per_client_rate=per_client_rate)
+        
+        # Downloads beyond max_transfers wait for a slot, 0 means no limit.
+        # Sending and waiting both occupy a pool worker, so the two together
+        # must leave workers for everything else.
+        if engine == 'pool' and max_transfers > 0 and \
+                max_transfers + queue_size > workers - RESERVED_WORKERS:
+            raise ValueError(
+                f"{max_transfers} transfers and a queue of {queue_size} need more than "
+                f"{workers} workers; the pool engine keeps {RESERVED_WORKERS} of them for "
+                f"pages, so use at least {max_transfers + queue_size + RESERVED_WORKERS} "
+                f"workers or a smaller queue"
+            )
+        self.admission = AdmissionController(
+            max_transfers, max_queue=queue_size, max_wait=queue_timeout
+        ) if max_transfers > 0 else None
+        
+        # Rendered listing of the current index version, and compressed
+        # text bodies, so unchanged pages are not rendered or encoded again
+        self._listing_page: Optional[Tuple[int, str]] = None
+        self._encoded_bodies = EncodedBodyCache()
+        # Distinguishes listing ETags of this run from an earlier one
+        self._boot_id = secrets.token_hex(4)
         
         # Create Flask app
         self.app = Flask(__name__, template_folder='templates')
@@ -58,7 +189,8 @@ class ShareServer:
         # Set up routes
         self._setup_routes()
         
-        # Server thread
+        # Serving engine and its thread
+        self.engine: Optional[ServingEngine] = None
         self.server_thread: Optional[threading.Thread] = None
         self.running = False
         
@@ -67,8 +199,8 @@ class ShareServer:
         
         @self.app.before_request
         def before_request():
-            self.stats['total_requests'] += 1
-            self.stats['clients'].add(request.remote_addr)
+            request.environ[REQUEST_START_KEY] = time.perf_counter()
+            self.stats.record_request(request.remote_addr)
             
             # Check password if set
             if self.password and self.access_token:
@@ -76,17 +208,64 @@ class ShareServer:
                 if token != self.access_token:
                     return "Unauthorized: Invalid or missing token", 401
         
+        @self.app.after_request
+        def after_request(response):
+            response = self._encode_response(response)
+            
+            # Streamed downloads are only finished when the server closes them
+            started = request.environ.get(REQUEST_START_KEY)
+            if started is not None:
+                response.call_on_close(
+                    lambda: self.stats.request_duration.observe(time.perf_counter() - started)
+                )
+            return response
+        
         @self.app.route('/')
         def index():
             """Main page showing files."""
-            files_info = self._get_files_info()
-            return render_template(
-                'index.html',
-                files=files_info,
-                total_files=len(files_info),
-                server_start=self.stats['start_time'].strftime('%Y-%m-%d %H:%M:%S'),
-                access_token=self.access_token
-            )
+            version = self.file_index.version
+            headers, not_modified = self._listing_validators(version, 'text/html')
+            if not_modified:
+                return Response(status=304, headers=headers)
+            
+            return Response(self._render_listing(version), mimetype='text/html', headers=headers)
+        
+        @self.app.route('/api/files')
+        def api_files():
+            """Paginated file listing."""
+            args = request.args
+            try:
+                limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+                offset = int(args['offset']) if 'offset' in args else None
+            except ValueError:
+                return jsonify({'error': 'limit and offset must be integers'}), 400
+            order = args.get('order', 'asc')
+            if order not in ('asc', 'desc'):
+                return jsonify({'error': "order must be 'asc' or 'desc'"}), 400
+            
+            listing = self.file_index.listing()
+            headers, not_modified = self._listing_validators(listing.version, 'application/json')
+            if not_modified:
+                return Response(status=304, headers=headers)
+            
+            try:
+                page = listing.page(
+                    directory=args.get('dir'),
+                    prefix=args.get('prefix', ''),
+                    sort=args.get('sort', 'name'),
+                    descending=order == 'desc',
+                    cursor=args.get('cursor'),
+                    offset=offset,
+                    limit=limit
+                )
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            except KeyError:
+                return jsonify({'error': 'Directory not found'}), 404
+            
+            response = jsonify(page)
+            response.headers.update(headers)
+            return response
         
         @self.app.route('/download/<path:filename>')
         def download_file(filename):
@@ -96,22 +275,31 @@ class ShareServer:
             if not file_path:
                 abort(404, description="File not found")
             
-            if self.one_time and filename in self.downloaded_files:
-                abort(410, description="File was already downloaded and removed")
-            
-            self.stats['total_downloads'] += 1
+            archive_format = None
+            if self.zip_folders and self.file_index.folder(file_path) is not None:
+                archive_format = request.args.get('format', self.archive_format)
+                if archive_format not in available_formats():
+                    abort(400, description=f"Unsupported archive format: {archive_format}")
             
-            if self.one_time:
-                self.downloaded_files.add(filename)
+            # Wait for a transfer slot before claiming, so a busy server does
+            # not use up a one-time download
+            release = None
+            if self.admission is not None:
+                try:
+                    release = self.admission.acquire()
+                except ServerBusy as busy:
+                    self.stats.rejected_transfers.add()
+                    return self._busy_response(busy)
             
-            if file_path.is_dir() and self.zip_folders:
-                return self._send_zipped_folder(file_path)
-            
-            return send_file(
-                str(file_path),
-                as_attachment=True,
-                download_name=file_path.name
-            )
+            try:
+                response = self._start_download(filename, file_path, archive_format)
+            except BaseException:
+                if release:
+                    release()
+                raise
+            if release:
+                response.call_on_close(release)
+            return response
         
         @self.app.route('/api/status')
         def api_status():
@@ -120,160 +308,623 @@ class ShareServer:
                 'status': 'running',
                 'port': self.port,
                 'files_count': len(self._get_files_info()),
-                'uptime': str(datetime.now() - self.stats['start_time']),
-                'total_requests': self.stats['total_requests'],
-                'total_downloads': self.stats['total_downloads'],
-                'unique_clients': len(self.stats['clients'])
+                'uptime': str(datetime.now() - self.stats.start_time),
+                'total_requests': self.stats.total_requests,
+                'total_downloads': self.stats.total_downloads,
+                'unique_clients': self.stats.unique_clients
             })
         
+        @self.app.route('/qr.png')
+        def qr_image():
+            """QR code of the share URL, for a projector or second screen."""
+            try:
+                size = int(request.args.get('size', QR_IMAGE_SIZE))
+            except ValueError:
+                return "size must be an integer", 400
+            size = max(QR_MIN_SIZE, min(size, QR_MAX_SIZE))
+            # Pillow and qrcode load on the first QR request, not at startup
+            from .qr_generator import qr_png
+            return self._qr_response(qr_png(self._qr_url(), size), 'image/png')
+        
+        @self.app.route('/qr.svg')
+        def qr_vector():
+            """QR code of the share URL as SVG."""
+            from .qr_generator import qr_svg
+            return self._qr_response(qr_svg(self._qr_url()), 'image/svg+xml')
+        
+        @self.app.route('/metrics')
+        def metrics():
+            """Prometheus metrics endpoint."""
+            return Response(
+                render_metrics(
+                    self.stats,
+                    files_count=len(self._get_files_info()),
+                    index_build_seconds=self.file_index.build_seconds,
+                    archive_cache_bytes=self.archive_cache.size if self.archive_cache is not None else None,
+                    queued_transfers=self.admission.waiting if self.admission is not None else None
+                ),
+                content_type=METRICS_CONTENT_TYPE
+            )
+        
         @self.app.route('/shutdown')
         def shutdown():
             """Endpoint to shutdown the server."""
             if request.remote_addr in ['127.0.0.1', 'localhost']:
-                self.stop()
+                # Stop from another thread so this request can complete while
+                # the engine drains
+                threading.Thread(target=self.stop, daemon=True).start()
                 return 'Server shutting down...'
             return 'Unauthorized', 403
     
+    def _start_download(self, filename: str, file_path: Path, archive_format: Optional[str]) -> Response:
+        """Count a download and build its response."""
+        # Claiming is atomic, so only one client gets a one-time file
+        if self.one_time and not self.stats.claim_once(filename):
+            abort(410, description="File was already downloaded and removed")
+        
+        self.stats.record_download()
+        transfer = self.stats.open_transfer(
+            filename,
+            request.environ.get(REQUEST_START_KEY),
+            throttle=self.rate_limiter.throttle(request.remote_addr)
+        )
+        
+        if archive_format is not None:
+            return self._send_folder_archive(file_path, transfer, archive_format)
+        return self._send_file(file_path, transfer)
+    
+    def _busy_response(self, busy: ServerBusy) -> Response:
+        """503 telling the client where it stood in the queue and when to retry."""
+        headers = {
+            'Retry-After': str(busy.retry_after),
+            'X-Queue-Position': str(busy.position),
+            # Browsers reload the page by themselves
+            'Refresh': str(busy.retry_after)
+        }
+        if request.accept_mimetypes.best_match(['text/plain', 'application/json']) == 'application/json':
+            response = jsonify({
+                'error': 'busy',
+                'queue_position': busy.position,
+                'retry_after': busy.retry_after
+            })
+            response.status_code = 503
+            response.headers.update(headers)
+            return response
+        return Response(
+            f"Server busy: you are number {busy.position} in the queue. "
+            f"Retrying in {busy.retry_after} seconds...\n",
+            status=503,
+            mimetype='text/plain',
+            headers=headers
+        )
+    
+    def _qr_url(self) -> str:
+        """Share URL for the address this request reached the server at."""
+        host = request.host.rpartition(':')[0] if ':' in request.host else request.host
+        host = host.strip('[]')
+        # Whoever scans the code needs an address on the LAN
+        if host in ('localhost', '::1') or host.startswith('127.'):
+            host = None
+        return self.get_url(host)
+    
+    def _qr_response(self, data: bytes, mimetype: str) -> Response:
+        """Serve rendered QR bytes with validators, they never change for a URL."""
+        etag = f'"{hashlib.sha1(data).hexdigest()[:20]}"'
+        headers = {
+            # Weak, since the SVG may be sent compressed
+            'ETag': f'W/{etag}',
+            # The code carries the access token, which no cache may keep
+            'Cache-Control': 'private, no-store' if self.access_token else 'public, max-age=86400'
+        }
+        if etag_matches(request.headers.get('If-None-Match'), etag):
+            return Response(status=304, headers=headers)
+        return Response(data, mimetype=mimetype, headers=headers)
+    
+    def _listing_validators(self, version: int, mimetype: str) -> Tuple[Dict[str, str], bool]:
+        """
+        Caching headers for responses derived from the file index.
+        
+        The ETag covers the path, query and response type besides the index
+        version, so the page and every /api/files page validate on their own.
+        Returns the headers and whether the client's copy is still current.
+        """
+        updated_at = self.file_index.updated_at
+        view = hashlib.sha1(f'{mimetype} {request.full_path}'.encode('utf-8')).hexdigest()[:12]
+        etag = f'"{self._boot_id}-{version}-{view}"'
+        headers = {
+            'ETag': f'W/{etag}',
+            'Last-Modified': http_date(updated_at),
+            # Revalidate every time; an unchanged listing costs a 304
+            'Cache-Control': 'no-cache'
+        }
+        
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match:
+            return headers, etag_matches(if_none_match, etag)
+        return headers, not_modified_since(request.headers.get('If-Modified-Since'), updated_at)
+    
+    def _render_listing(self, version: int) -> str:
+        """Render the index page, reusing the last render for the same index version."""
+        cached = self._listing_page
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        
+        started = time.perf_counter()
+        # Entries are fetched page by page from /api/files
+        page = render_template(
+            'index.html',
+            total_files=len(self._get_files_info()),
+            server_start=self.stats.start_time.strftime('%Y-%m-%d %H:%M:%S'),
+            access_token=self.access_token
+        )
+        self.stats.listing_render.observe(time.perf_counter() - started)
+        self._listing_page = (version, page)
+        return page
+    
+    def _encode_response(self, response: Response) -> Response:
+        """Compress text responses for clients that accept gzip or brotli."""
+        if (response.direct_passthrough or response.is_streamed
+                or response.status_code != 200
+                or response.mimetype not in COMPRESSIBLE_TYPES
+                or 'Content-Encoding' in response.headers):
+            return response
+        
+        response.vary.add('Accept-Encoding')
+        encoding = negotiate_encoding(request.headers.get('Accept-Encoding'))
+        if encoding is None:
+            return response
+        data = response.get_data()
+        if len(data) < MIN_COMPRESS_SIZE:
+            return response
+        
+        etag = response.headers.get('ETag')
+        resource = request.full_path
+        body = self._encoded_bodies.get(resource, etag, encoding) if etag else None
+        if body is None:
+            body = compress(data, encoding)
+            if etag:
+                self._encoded_bodies.put(resource, etag, encoding, body)
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        return response
+    
     def _get_files_info(self) -> List[Dict[str, Any]]:
         """Get information about all shared files."""
-        files_info = []
-        
-        for path in self.paths:
-            if path.is_file():
-                size = path.stat().st_size
-                files_info.append({
-                    'name': path.name,
-                    'size': size,
-                    'size_human': self._format_size(size),
-                    'type': 'file',
-                    'url': f'/download/{path.name}'
-                })
-            elif path.is_dir():
-                if self.zip_folders:
-                    # Calculate total size of folder
-                    total_size = sum(f.stat().st_size for f in path.rglob('*') if f.is_file())
-                    files_info.append({
-                        'name': f'{path.name}.zip',
-                        'size': total_size,
-                        'size_human': self._format_size(total_size),
-                        'type': 'folder',
-                        'url': f'/download/{path.name}.zip',
-                        'file_count': len(list(path.rglob('*')))
-                    })
-                else:
-                    # List all files in folder
-                    for file_path in path.rglob('*'):
-                        if file_path.is_file():
-                            size = file_path.stat().st_size
-                            rel_path = file_path.relative_to(path)
-                            files_info.append({
-                                'name': str(rel_path),
-                                'size': size,
-                                'size_human': self._format_size(size),
-                                'type': 'file',
-                                'url': f'/download/{rel_path}'
-                            })
-        
-        return files_info
+        return self.file_index.files_info()
     
     def _find_file_path(self, filename: str) -> Optional[Path]:
         """Find the actual file path from filename."""
-        for path in self.paths:
-            if path.is_file() and path.name == filename:
-                return path
-            elif path.is_dir():
-                # Check for direct file match
-                if path.name == filename.replace('.zip', ''):
-                    return path
-                # Check for nested files
-                file_path = path / filename
-                if file_path.exists() and file_path.is_file():
-                    return file_path
-        return None
+        return self.file_index.resolve(filename)
     
-    def _send_zipped_folder(self, folder_path: Path):
-        """Create and send a zipped folder."""
-        memory_file = io.BytesIO()
-        
-        with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zf:
-            for file_path in folder_path.rglob('*'):
-                if file_path.is_file():
-                    # Preserve directory structure
-                    arcname = file_path.relative_to(folder_path)
-                    zf.write(file_path, arcname)
-        
-        memory_file.seek(0)
-        
-        return send_file(
-            memory_file,
-            mimetype='application/zip',
-            as_attachment=True,
-            download_name=f'{folder_path.name}.zip'
+    def _send_file(self, file_path: Path, transfer: Transfer):
+        """Send a regular file, honouring Range and conditional headers."""
+        try:
+            st = file_path.stat()
+        except OSError:
+            abort(404, description="File not found")
+        mimetype = mimetypes.guess_type(file_path.name)[0] or 'application/octet-stream'
+        
+        return self._send_ranged(
+            length=st.st_size,
+            etag=file_etag(st),
+            mtime=st.st_mtime,
+            mimetype=mimetype,
+            download_name=file_path.name,
+            iter_ranges=self._file_range_reader(file_path, transfer),
+            transfer=transfer
         )
     
-    def _format_size(self, size_bytes: int) -> str:
-        """Format file size in human readable format."""
-        for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
-            if size_bytes < 1024.0:
-                return f"{size_bytes:.1f} {unit}"
-            size_bytes /= 1024.0
-        return f"{size_bytes:.1f} PB"
+    def _file_range_reader(self, file_path: Path, transfer: Transfer):
+        """Return an iter_ranges callable for a regular file, using sendfile if possible."""
+        sock = request.environ.get(SOCKET_ENVIRON_KEY) if self.use_sendfile else None
+        if sock is not None:
+            return partial(iter_sendfile_ranges, sock, file_path,
+                           on_sent=transfer.add_bytes, throttle=transfer.throttle)
+        return partial(iter_file_ranges, file_path)
     
-    def start(self):
-        """Start the HTTP server in a separate thread."""
-        if self.running:
-            return
+    def _send_folder_archive(self, folder_path: Path, transfer: Transfer, archive_format: str = 'zip'):
+        """
+        Send a folder as an archive in the given format.
         
-        self.running = True
+        A cached copy is sent like a regular file. Otherwise the archive is
+        streamed while it is being built, and recorded into the cache.
+        """
+        snapshot = self.file_index.folder(folder_path)
+        if snapshot is None:
+            abort(404, description="File not found")
         
-        # Start server in a thread
-        self.server_thread = threading.Thread(
-            target=self.app.run,
-            kwargs={
-                'host': '0.0.0.0',
-                'port': self.port,
-                'debug': False,
-                'threaded': True,
-                'use_reloader': False
-            },
-            daemon=True
+        members = snapshot.members
+        etag = archive_etag(snapshot.fingerprint, self.zip_policy, archive_format)
+        suffix, mimetype = ARCHIVE_FORMATS[archive_format]
+        download_name = f'{folder_path.name}{suffix}'
+        
+        if self.archive_cache is not None:
+            cached = self.archive_cache.get(etag)
+            if cached is not None:
+                try:
+                    st = cached.stat()
+                except OSError:
+                    pass
+                else:
+                    self.stats.archive_cache_hits.add()
+                    # Same bytes as a fresh build, so the archive ETag still applies
+                    return self._send_ranged(
+                        length=st.st_size,
+                        etag=etag,
+                        mtime=None,
+                        mimetype=mimetype,
+                        download_name=download_name,
+                        iter_ranges=self._file_range_reader(cached, transfer),
+                        transfer=transfer
+                    )
+            self.stats.archive_cache_misses.add()
+        
+        def build():
+            return self._build_archive(folder_path, members, etag, archive_format)
+        
+        length = self._archive_length(etag)
+        if length is None:
+            length = self._predict_archive_length(members, archive_format)
+        
+        if length is not None:
+            # The archive is reproducible byte for byte, so ranges can be
+            # cut from a fresh build once its total length is known
+            return self._send_ranged(
+                length=length,
+                etag=etag,
+                mtime=None,
+                mimetype=mimetype,
+                download_name=download_name,
+                iter_ranges=lambda ranges: iter_stream_ranges(build(), ranges),
+                transfer=transfer
+            )
+        
+        headers = {
+            'ETag': etag,
+            'Accept-Ranges': 'none',
+            'Content-Disposition': self._content_disposition(download_name)
+        }
+        if etag_matches(request.headers.get('If-None-Match'), etag):
+            return Response(status=304, headers=headers)
+        
+        return _PassthroughResponse(
+            transfer.wrap(self._record_archive_length(etag, build())),
+            mimetype=mimetype,
+            headers=headers,
+            direct_passthrough=True
         )
+    
+    def _predict_archive_length(self, members, archive_format: str) -> Optional[int]:
+        """Length of an uncompressed archive, which follows from the listing alone."""
+        if archive_format == 'tar':
+            return tar_length(members)
+        if archive_format == 'zip' and self.zip_policy.stores_all:
+            return stored_zip_length(members)
+        return None
+    
+    def _build_archive(self, folder_path: Path, members, etag: str,
+                       archive_format: str = 'zip', files=None):
+        """Build a folder archive, recording it into the cache if there is one."""
+        if files is None:
+            files = ((folder_path / arcname, arcname, size, mtime_ns) for arcname, size, mtime_ns in members)
+        if archive_format == 'zip':
+            chunks = iter_zip(
+                folder_path,
+                policy=self.zip_policy,
+                files=files,
+                executor=self._zip_pool,
+                window=2 * self.zip_workers
+            )
+        else:
+            chunks = iter_tar(folder_path, files=files)
+            if archive_format == 'tar.zst':
+                # zstd runs its own worker threads, sized like the deflate pool
+                chunks = iter_zstd(chunks, threads=self.zip_workers)
+        chunks = self._time_archive_build(chunks)
+        if self.archive_cache is not None:
+            chunks = self.archive_cache.record(etag, chunks)
+        return self._rescan_on_change(folder_path, etag, chunks)
+    
+    def _rescan_on_change(self, folder_path: Path, etag: str, chunks):
+        """
+        Pass archive chunks through, catching up with a folder that changed.
         
-        self.server_thread.start()
+        The current response cannot be saved, but the remembered length of
+        the stale archive is dropped and the folder rescanned, so the next
+        request is planned from what is on disk now.
+        """
+        try:
+            yield from chunks
+        except ArchiveChanged:
+            with self._archive_lengths_lock:
+                self._archive_lengths.pop(etag, None)
+            try:
+                self.file_index.rescan_folder(folder_path)
+            except Exception as e:
+                print(f"Warning: Could not rescan {folder_path.name}: {e}")
+            raise
+    
+    def prebuild_archives(self, on_progress: Optional[Callable[[str, int, int], None]] = None
+                          ) -> Optional[threading.Thread]:
+        """
+        Build the archive of every shared folder in a background thread.
         
-        # Set timeout if specified
-        if self.timeout:
-            def stop_after_timeout():
-                time.sleep(self.timeout)
-                if self.running:
-                    print(f"\n\033[93mTimeout ({self.timeout}s) reached. Server shutting down...\033[0m")
-                    import os
-                    os._exit(0)
-            
-            threading.Thread(target=stop_after_timeout, daemon=True).start()
+        The archives go to the archive cache, so the first download is sent
+        from disk instead of waiting for compression.
+        
+        Args:
+            on_progress: Called with (archive name, bytes read, total bytes)
+                as members are read, and with bytes read equal to the total
+                once an archive is complete
         
-        # Wait a moment for server to start
-        time.sleep(0.5)
+        Returns:
+            The builder thread, or None if there is nothing to build
+        """
+        if self.archive_cache is None or not self.zip_folders:
+            return None
+        folders = [path for path in self.paths if self.file_index.folder(path) is not None]
+        if not folders:
+            return None
+        
+        thread = threading.Thread(target=self._prebuild, args=(folders, on_progress), daemon=True)
+        thread.start()
+        return thread
     
-    def stop(self):
-        """Stop the HTTP server."""
-        self.running = False
+    def _prebuild(self, folders: List[Path], on_progress):
+        for folder_path in folders:
+            snapshot = self.file_index.folder(folder_path)
+            if snapshot is None:
+                continue
+            name = f'{folder_path.name}{ARCHIVE_FORMATS[self.archive_format][0]}'
+            etag = archive_etag(snapshot.fingerprint, self.zip_policy, self.archive_format)
+            
+            if etag not in self.archive_cache:
+                files = self._iter_prebuild_files(folder_path, snapshot, name, on_progress)
+                chunks = self._build_archive(folder_path, snapshot.members, etag,
+                                             self.archive_format, files=files)
+                try:
+                    for _ in chunks:
+                        if not self.running:
+                            return
+                except Exception as e:
+                    print(f"Warning: Could not prebuild {name}: {e}")
+                    continue
+                finally:
+                    chunks.close()
+            
+            if on_progress:
+                on_progress(name, snapshot.total_size, snapshot.total_size)
+    
+    @staticmethod
+    def _iter_prebuild_files(folder_path: Path, snapshot, name: str, on_progress):
+        """Yield archive members, reporting progress as each one is started."""
+        done = 0
+        for arcname, size, mtime_ns in snapshot.members:
+            if on_progress:
+                on_progress(name, done, snapshot.total_size)
+            yield folder_path / arcname, arcname, size, mtime_ns
+            done += size
+    
+    def _record_archive_length(self, etag: str, chunks):
+        """Pass archive chunks through and remember the length once complete."""
+        total = 0
+        for chunk in chunks:
+            total += len(chunk)
+            yield chunk
+        with self._archive_lengths_lock:
+            self._archive_lengths[etag] = total
+            self._archive_lengths.move_to_end(etag)
+            while len(self._archive_lengths) > ARCHIVE_LENGTHS_MAX:
+                self._archive_lengths.popitem(last=False)
+    
+    def _archive_length(self, etag: str) -> Optional[int]:
+        """Length of a completely built archive, if it is remembered."""
+        with self._archive_lengths_lock:
+            length = self._archive_lengths.get(etag)
+            if length is not None:
+                self._archive_lengths.move_to_end(etag)
+            return length
+    
+    def _time_archive_build(self, chunks):
+        """Pass archive chunks through and time complete builds."""
+        started = time.perf_counter()
+        for chunk in chunks:
+            yield chunk
+        self.stats.archive_build.observe(time.perf_counter() - started)
+    
+    def _send_ranged(self, length: int, etag: str, mtime: Optional[float],
+                     mimetype: str, download_name: str, iter_ranges,
+                     transfer: Optional[Transfer] = None):
+        """
+        Build a 200, 206, 304, 412 or 416 response for a representation.
+        
+        Args:
+            length: Total length in bytes
+            etag: Strong entity tag
+            mtime: Modification time for Last-Modified, if meaningful
+            mimetype: Content type of the representation
+            download_name: File name offered to the client
+            iter_ranges: Callable taking sorted ranges and yielding
+                (range index, data) pieces
+            transfer: Accounting for the response body, if any
+        """
+        headers = {
+            'ETag': etag,
+            'Accept-Ranges': 'bytes',
+            'Content-Disposition': self._content_disposition(download_name)
+        }
+        if mtime is not None:
+            headers['Last-Modified'] = http_date(mtime)
+        
+        if_match = request.headers.get('If-Match')
+        if if_match and not etag_matches(if_match, etag, weak=False):
+            return Response(status=412, headers=headers)
+        
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match:
+            if etag_matches(if_none_match, etag):
+                return Response(status=304, headers=headers)
+        elif mtime is not None and not_modified_since(request.headers.get('If-Modified-Since'), mtime):
+            return Response(status=304, headers=headers)
+        
+        ranges = None
+        if if_range_matches(request.headers.get('If-Range'), etag, mtime):
+            ranges = parse_range(request.headers.get('Range'), length)
+        
+        if ranges is None:
+            full = [(0, length - 1)] if length else []
+            body = (data for _, data in iter_ranges(full))
+            status = 200
+            content_length = length
+        elif not ranges:
+            headers['Content-Range'] = f'bytes */{length}'
+            return Response(status=416, headers=headers)
+        elif len(ranges) == 1:
+            body = (data for _, data in iter_ranges(ranges))
+            status = 206
+            content_length = ranges[0][1] - ranges[0][0] + 1
+            headers['Content-Range'] = content_range(ranges[0], length)
+        else:
+            boundary = secrets.token_hex(16)
+            body = iter_multipart(iter_ranges(ranges), ranges, length, mimetype, boundary)
+            status = 206
+            content_length = multipart_length(ranges, length, mimetype, boundary)
+            mimetype = f'multipart/byteranges; boundary={boundary}'
         
-        # Try to shutdown gracefully
+        if transfer is not None:
+            body = transfer.wrap(body)
+        
+        response = _PassthroughResponse(
+            body,
+            status=status,
+            content_type=mimetype,
+            headers=headers,
+            direct_passthrough=True
+        )
+        response.content_length = content_length
+        return response
+    
+    def _content_disposition(self, filename: str) -> str:
+        """Build an attachment Content-Disposition header value."""
         try:
-            import requests
-            requests.get(f'http://127.0.0.1:{self.port}/shutdown', timeout=1)
-        except:
-            pass
-        
-        # Force stop if still running
-        if self.server_thread and self.server_thread.is_alive():
-            time.sleep(1)
+            filename.encode('latin-1')
+            simple = filename
+        except UnicodeEncodeError:
+            simple = filename.encode('ascii', 'replace').decode('ascii')
+        
+        escaped = simple.replace('\\', '\\\\').replace('"', '\\"')
+        value = f'attachment; filename="{escaped}"'
+        if simple != filename:
+            value += "; filename*=UTF-8''" + quote(filename)
+        return value
     
-    def wait_for_stop(self):
-        """Wait for server to stop."""
+    def start(self):
+        """
+        Start the HTTP server in a separate thread.
+        
+        Returns as soon as the socket is listening, with port set to the
+        bound port. Bind errors such as a port in use raise OSError here.
+        Sets ready and calls on_ready once the server accepts connections.
+        """
+        with self._lifecycle_lock:
+            if self.running:
+                return
+            
+            # Binding and listening happen here; connections queue from now on
+            self.engine = create_engine(
+                self.engine_name,
+                self.app,
+                '0.0.0.0',
+                self.port,
+                workers=self.workers,
+                max_connections=self.max_connections
+            )
+            self.port = self.engine.port
+            # stop() shuts the deflate pool down, so a restart needs a new one
+            if self._zip_pool is None and self.zip_workers > 1:
+                self._zip_pool = ThreadPoolExecutor(max_workers=self.zip_workers)
+            self.running = True
+            self.stopped.clear()
+            
+            self.server_thread = threading.Thread(
+                target=self.engine.serve_forever,
+                daemon=True
+            )
+            self.server_thread.start()
+            self.file_index.start_watching()
+            
+            if self.announce:
+                from .discovery import Beacon
+                self.beacon = Beacon(self.port, self._beacon_status)
+                try:
+                    self.beacon.start()
+                except OSError as e:
+                    # Sharing works without it, clients just have to be told the URL
+                    print(f"Warning: Could not announce the server on the network: {e}")
+                    self.beacon = None
+            
+            # Stop by itself once the timeout runs out, unless stopped before
+            if self.timeout:
+                def stop_after_timeout():
+                    if not self.stopped.wait(self.timeout) and self.running:
+                        print(f"\n\033[93mTimeout ({self.timeout}s) reached. Server shutting down...\033[0m")
+                        self.stop()
+                
+                threading.Thread(target=stop_after_timeout, daemon=True).start()
+            
+            self.ready.set()
+        if self.on_ready is not None:
+            self.on_ready(self)
+    
+    def stop(self, timeout: Optional[float] = None) -> bool:
+        """
+        Stop accepting connections and let running transfers drain.
+        
+        Transfers still running after timeout seconds (drain_timeout by
+        default) are cut off. Safe to call from any thread, and more than
+        once.
+        
+        Returns:
+            True if every transfer finished in time
+        """
+        with self._lifecycle_lock:
+            if not self.running:
+                return True
+            self.running = False
+            self.ready.clear()
+        
+        self.file_index.stop_watching()
+        if self.beacon is not None:
+            self.beacon.stop()
+            self.beacon = None
+        
+        drained = True
+        if self.engine:
+            drained = self.engine.shutdown(timeout=self.drain_timeout if timeout is None else timeout)
         if self.server_thread:
             self.server_thread.join()
+        if self._zip_pool:
+            self._zip_pool.shutdown(wait=False)
+            self._zip_pool = None
+        if self.archive_cache is not None:
+            self.archive_cache.clear()
+        self.stopped.set()
+        return drained
+    
+    def wait_for_stop(self, timeout: Optional[float] = None) -> bool:
+        """Wait for the server to stop. Returns False if timeout ran out first."""
+        if self.server_thread is None:
+            return True
+        return self.stopped.wait(timeout)
+    
+    def _beacon_status(self) -> Dict[str, Any]:
+        """What the LAN announcement says about this server."""
+        return {
+            'name': socket.gethostname(),
+            'files': len(self._get_files_info()),
+            'protected': bool(self.password),
+            'uptime': str(datetime.now() - self.stats.start_time)
+        }
     
     def get_url(self, ip: str = None) -> str:
         """Get the URL for accessing the server."""
@@ -0,0 +1,129 @@
+"""
+NullShare bandwidth shaping
+"""
+import re
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+_RATE_PATTERN = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([kmg]?)(?:i?b)?(?:/s)?\s*$', re.IGNORECASE)
+_RATE_UNITS = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+
+# Smallest burst a bucket allows, so one read from disk always fits
+MIN_BURST = 64 * 1024
+
+# Per-client buckets idle for this long are dropped
+_CLIENT_IDLE_SECONDS = 60.0
+
+
+def parse_rate(value: str) -> int:
+    """
+    Parse a rate such as '500K', '20M' or '1.5GiB/s' into bytes per second.
+
+    Suffixes are binary multiples. Raises ValueError for anything else.
+    """
+    match = _RATE_PATTERN.match(str(value))
+    if not match:
+        raise ValueError(f"Invalid rate '{value}', expected e.g. 500K, 20M or 1G")
+    rate = int(float(match.group(1)) * _RATE_UNITS[match.group(2).lower()])
+    if rate <= 0:
+        raise ValueError("Rate must be positive")
+    return rate
+
+
+class TokenBucket:
+    """
+    Token bucket that makes callers wait for their turn.
+
+    consume() reserves the tokens right away and sleeps off any debt
+    outside the lock. Reservations are taken in arrival order, so transfers
+    that keep asking for a chunk at a time are served round robin and share
+    the rate evenly, while a transfer stalled on a slow client leaves its
+    share to the others.
+    """
+
+    def __init__(self, rate: int, burst: Optional[int] = None):
+        self.rate = rate
+        self.burst = max(burst if burst is not None else rate // 10, MIN_BURST)
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: int) -> float:
+        """Take amount tokens and return how long to wait before using them."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= amount
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+    def consume(self, amount: int):
+        """Block until amount bytes may be sent."""
+        delay = self.reserve(amount)
+        if delay > 0:
+            time.sleep(delay)
+
+    @property
+    def idle(self) -> bool:
+        """True if the bucket has refilled completely."""
+        with self._lock:
+            return self._tokens + (time.monotonic() - self._last) * self.rate >= self.burst
+
+
+class RateLimiter:
+    """
+    Global and per-client upload limits.
+
+    Every chunk of a download passes its client's bucket and then the
+    global one. Either limit can be left out.
+    """
+
+    def __init__(self, max_rate: Optional[int] = None, per_client_rate: Optional[int] = None):
+        self.max_rate = max_rate
+        self.per_client_rate = per_client_rate
+        self._global = TokenBucket(max_rate) if max_rate else None
+        self._clients: Dict[str, TokenBucket] = {}
+        self._clients_used: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.max_rate or self.per_client_rate)
+
+    def _client_bucket(self, client: str) -> TokenBucket:
+        with self._lock:
+            now = time.monotonic()
+            bucket = self._clients.get(client)
+            if bucket is None:
+                # Forget clients that have gone quiet before adding another
+                for other, used in list(self._clients_used.items()):
+                    other_bucket = self._clients.get(other)
+                    if other_bucket is None or (now - used > _CLIENT_IDLE_SECONDS and other_bucket.idle):
+                        self._clients.pop(other, None)
+                        self._clients_used.pop(other, None)
+                bucket = TokenBucket(self.per_client_rate)
+                self._clients[client] = bucket
+            self._clients_used[client] = now
+            return bucket
+
+    def throttle(self, client: str) -> Optional[Callable[[int], None]]:
+        """
+        Return a callable that blocks until a number of bytes may be sent
+        to client, or None when no limit is set.
+        """
+        if not self.enabled:
+            return None
+        buckets = []
+        if self.per_client_rate:
+            buckets.append(self._client_bucket(client))
+        if self._global is not None:
+            buckets.append(self._global)
+
+        def wait(amount: int):
+            if self.per_client_rate:
+                # Keeps the client's bucket from being pruned mid-transfer
+                self._clients_used[client] = time.monotonic()
+            for bucket in buckets:
+                bucket.consume(amount)
+        return wait
@@ -0,0 +1,302 @@
+"""
+NullShare server statistics
+"""
+import threading
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from datetime import datetime
+from typing import Any, Callable, Dict, Hashable, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+# Histogram bucket bounds
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+THROUGHPUT_BUCKETS = tuple(float(1 << shift) for shift in range(16, 32, 2))  # 64 KiB/s .. 1 GiB/s
+
+# Shards a metric may hold before a new thread's first write retires dead ones
+SHARDS_PRUNE_AT = 64
+
+
+class _ThreadShards(ABC):
+    """
+    One shard per thread, written only by its owner.
+
+    Writers never take a lock after their first access. Readers aggregate
+    the shards and fold those of finished threads into a retired total, so
+    short-lived connection threads do not pile up. A metric nobody reads is
+    pruned the same way by first writes, once its shards pass a threshold
+    that doubles with the number still alive.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards: List[Tuple[threading.Thread, Any]] = []
+        self._prune_at = SHARDS_PRUNE_AT
+
+    @abstractmethod
+    def _new_shard(self) -> Any:
+        """Empty shard for a thread's first write."""
+
+    @abstractmethod
+    def _retire(self, shard: Any):
+        """Fold the shard of a finished thread into the retired total."""
+
+    def _shard(self) -> Any:
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._new_shard()
+            self._local.shard = shard
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+                if len(self._shards) >= self._prune_at:
+                    self._live_shards()
+                    self._prune_at = max(SHARDS_PRUNE_AT, 2 * len(self._shards))
+        return shard
+
+    def _live_shards(self) -> List[Any]:
+        """Retire shards of dead threads and return the rest. Caller holds the lock."""
+        live = []
+        shards = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append(shard)
+                shards.append((thread, shard))
+            else:
+                self._retire(shard)
+        self._shards = shards
+        return live
+
+
+class ShardedCounter(_ThreadShards):
+    """Counter that can be incremented from many threads without contention."""
+
+    def __init__(self):
+        super().__init__()
+        self._retired = 0
+
+    def _new_shard(self) -> List[int]:
+        return [0]
+
+    def _retire(self, shard: List[int]):
+        self._retired += shard[0]
+
+    def add(self, amount: int = 1):
+        """Add to the counter from the calling thread."""
+        self._shard()[0] += amount
+
+    @property
+    def value(self) -> int:
+        with self._lock:
+            live = self._live_shards()
+            return self._retired + sum(shard[0] for shard in live)
+
+
+class ShardedSet(_ThreadShards):
+    """Set that many threads add to; the union is built on read."""
+
+    def __init__(self):
+        super().__init__()
+        self._retired: Set[Hashable] = set()
+
+    def _new_shard(self) -> Set[Hashable]:
+        return set()
+
+    def _retire(self, shard: Set[Hashable]):
+        self._retired |= shard
+
+    def add(self, item: Hashable):
+        """Add an item from the calling thread."""
+        shard = self._shard()
+        if item not in shard:
+            shard.add(item)
+
+    def union(self) -> Set[Hashable]:
+        with self._lock:
+            live = self._live_shards()
+            result = set(self._retired)
+            for shard in live:
+                result |= shard
+            return result
+
+    def __len__(self) -> int:
+        return len(self.union())
+
+
+class LabeledCounter(_ThreadShards):
+    """Counter per label value, e.g. bytes sent per file."""
+
+    def __init__(self):
+        super().__init__()
+        self._retired: Dict[str, int] = {}
+
+    def _new_shard(self) -> Dict[str, int]:
+        return {}
+
+    def _retire(self, shard: Dict[str, int]):
+        for label, value in shard.items():
+            self._retired[label] = self._retired.get(label, 0) + value
+
+    def add(self, label: str, amount: int = 1):
+        shard = self._shard()
+        shard[label] = shard.get(label, 0) + amount
+
+    def values(self) -> Dict[str, int]:
+        with self._lock:
+            live = self._live_shards()
+            result = dict(self._retired)
+            for shard in live:
+                for label, value in list(shard.items()):
+                    result[label] = result.get(label, 0) + value
+            return result
+
+
+class Histogram(_ThreadShards):
+    """Bucketed distribution of observed values."""
+
+    def __init__(self, buckets: Sequence[float]):
+        super().__init__()
+        self.buckets = tuple(buckets)
+        self._retired = self._new_shard()
+
+    def _new_shard(self) -> List[float]:
+        # One slot per bucket, one for +Inf, then sum and count
+        return [0] * (len(self.buckets) + 3)
+
+    def _retire(self, shard: List[float]):
+        for i, value in enumerate(shard):
+            self._retired[i] += value
+
+    def observe(self, value: float):
+        shard = self._shard()
+        shard[bisect_left(self.buckets, value)] += 1
+        shard[-2] += value
+        shard[-1] += 1
+
+    def collect(self) -> Tuple[List[int], float, int]:
+        """Return (cumulative bucket counts including +Inf, sum, count)."""
+        with self._lock:
+            live = self._live_shards()
+            totals = list(self._retired)
+            for shard in live:
+                for i, value in enumerate(shard):
+                    totals[i] += value
+        cumulative = []
+        running = 0
+        for count in totals[:-2]:
+            running += count
+            cumulative.append(int(running))
+        return cumulative, totals[-2], int(totals[-1])
+
+
+class Transfer:
+    """Timing and byte accounting for one download response."""
+
+    def __init__(self, stats: 'ServerStats', name: str, started: float,
+                 throttle: Optional[Callable[[int], None]] = None):
+        self.stats = stats
+        self.name = name
+        self.started = started
+        # Blocks until a number of bytes may be sent, if rates are limited
+        self.throttle = throttle
+        self.bytes_sent = 0
+
+    def add_bytes(self, amount: int):
+        """Count bytes that went out without passing through wrap()."""
+        if amount:
+            self.bytes_sent += amount
+            self.stats.bytes_sent.add(self.name, amount)
+
+    def wrap(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """Pass a response body through, recording TTFB and throughput."""
+        self.stats.active_transfers.add(1)
+        first = True
+        try:
+            for data in chunks:
+                if first:
+                    self.stats.time_to_first_byte.observe(time.perf_counter() - self.started)
+                    first = False
+                if self.throttle and data:
+                    self.throttle(len(data))
+                self.add_bytes(len(data))
+                yield data
+        finally:
+            self.stats.active_transfers.add(-1)
+            elapsed = time.perf_counter() - self.started
+            if self.bytes_sent and elapsed > 0:
+                self.stats.download_throughput.observe(self.bytes_sent / elapsed)
+
+
+class ServerStats:
+    """Request and download statistics of a ShareServer."""
+
+    def __init__(self):
+        self.start_time = datetime.now()
+        self._requests = ShardedCounter()
+        self._downloads = ShardedCounter()
+        self._clients = ShardedSet()
+        self._claims_lock = threading.Lock()
+        self._claimed: Set[str] = set()
+
+        # Exported on /metrics
+        self.bytes_sent = LabeledCounter()
+        self.active_transfers = ShardedCounter()
+        self.request_duration = Histogram(SECONDS_BUCKETS)
+        self.time_to_first_byte = Histogram(SECONDS_BUCKETS)
+        self.download_throughput = Histogram(THROUGHPUT_BUCKETS)
+        self.archive_build = Histogram(SECONDS_BUCKETS)
+        self.archive_cache_hits = ShardedCounter()
+        self.archive_cache_misses = ShardedCounter()
+        self.rejected_transfers = ShardedCounter()
+        self.listing_render = Histogram(SECONDS_BUCKETS)
+
+    def record_request(self, client: str):
+        """Count a request from a client address."""
+        self._requests.add()
+        self._clients.add(client)
+
+    def record_download(self):
+        """Count a started download."""
+        self._downloads.add()
+
+    def open_transfer(self, name: str, started: Optional[float] = None,
+                      throttle: Optional[Callable[[int], None]] = None) -> Transfer:
+        """Create accounting for a download; nothing is recorded until it is sent."""
+        return Transfer(self, name, started if started is not None else time.perf_counter(), throttle)
+
+    def claim_once(self, name: str) -> bool:
+        """
+        Atomically claim a one-time download.
+
+        Returns True for exactly one caller per name.
+        """
+        with self._claims_lock:
+            if name in self._claimed:
+                return False
+            self._claimed.add(name)
+            return True
+
+    @property
+    def total_requests(self) -> int:
+        return self._requests.value
+
+    @property
+    def total_downloads(self) -> int:
+        return self._downloads.value
+
+    @property
+    def unique_clients(self) -> int:
+        return len(self._clients)
+
+    @property
+    def downloaded_files(self) -> Set[str]:
+        with self._claims_lock:
+            return set(self._claimed)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Aggregate all counters."""
+        return {
+            'start_time': self.start_time,
+            'total_requests': self.total_requests,
+            'total_downloads': self.total_downloads,
+            'unique_clients': self.unique_clients
+        }
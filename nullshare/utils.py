@@ -2,7 +2,6 @@
 Utility functions for NullShare
 """
 import socket
-import netifaces
 import os
 import sys
 from pathlib import Path
@@ -30,6 +29,8 @@ def get_local_ip() -> str:
     
     # Method 2: Use netifaces to find first non-local IP
     try:
+        # Imported here, most commands never get this far
+        import netifaces
         for interface in netifaces.interfaces():
             addrs = netifaces.ifaddresses(interface)
             if netifaces.AF_INET in addrs:
@@ -25,6 +25,12 @@ setup(
         "netifaces>=0.11.0",
     ],
     extras_require={
+        "zstd": [
+            "zstandard>=0.15.0",
+        ],
+        "brotli": [
+            "Brotli>=1.0.0",
+        ],
         "dev": [
             "pytest>=7.0.0",
             "pytest-cov>=4.0.0",
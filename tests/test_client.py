@@ -0,0 +1,102 @@
+import hashlib
+import logging
+import os
+import time
+
+import pytest
+
+from nullshare.client import DownloadClient, DownloadProgress
+from nullshare.engine import SOCKET_ENVIRON_KEY
+from nullshare.server import ShareServer
+
+logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+
+@pytest.fixture
+def shared_file(tmp_path):
+    path = tmp_path / 'share' / 'data.bin'
+    path.parent.mkdir()
+    path.write_bytes(os.urandom(4 * 1024 * 1024))
+    return path
+
+
+def _slow_first_stream(server, delay, chunk_delay):
+    """
+    Answer bounded Range requests after delay, and trickle open-ended ones
+    out a chunk every chunk_delay seconds.
+    """
+    app = server.app.wsgi_app
+
+    def wrapped(environ, start_response):
+        requested = environ.get('HTTP_RANGE', '')
+        if not requested:
+            return app(environ, start_response)
+        if not requested.endswith('-'):
+            time.sleep(delay)
+            return app(environ, start_response)
+        # No sendfile, so the body passes through here
+        environ.pop(SOCKET_ENVIRON_KEY, None)
+        body = app(environ, start_response)
+
+        def trickle():
+            try:
+                for chunk in body:
+                    time.sleep(chunk_delay)
+                    yield chunk
+            finally:
+                if hasattr(body, 'close'):
+                    body.close()
+        return trickle()
+
+    server.app.wsgi_app = wrapped
+
+
+def test_late_segment_response_is_written_at_its_own_offset(shared_file, tmp_path):
+    # The open-ended stream moves well into the second segment while that
+    # segment's own request is still waiting for its answer
+    server = ShareServer([shared_file], port=0)
+    _slow_first_stream(server, delay=1.0, chunk_delay=0.05)
+    server.start()
+    try:
+        out = tmp_path / 'out'
+        client = DownloadClient(f'http://127.0.0.1:{server.port}/', out, segments=4,
+                                min_segment_size=1024 * 1024, chunk_size=64 * 1024)
+        try:
+            failures = client.download_all(client.list_files(), DownloadProgress())
+        finally:
+            client.close()
+    finally:
+        server.stop(timeout=0)
+
+    assert failures == []
+    downloaded = (out / 'data.bin').read_bytes()
+    assert hashlib.md5(downloaded).hexdigest() == hashlib.md5(shared_file.read_bytes()).hexdigest()
+
+
+def test_folder_archive_is_fetched_in_one_stream(tmp_path):
+    folder = tmp_path / 'share'
+    folder.mkdir()
+    for i in range(4):
+        (folder / f'{i}.bin').write_bytes(os.urandom(1024 * 1024))
+    server = ShareServer([folder], port=0, zip_level=0)
+    ranges = []
+    app = server.app.wsgi_app
+
+    def record(environ, start_response):
+        ranges.append(environ.get('HTTP_RANGE'))
+        return app(environ, start_response)
+
+    server.app.wsgi_app = record
+    server.start()
+    try:
+        client = DownloadClient(f'http://127.0.0.1:{server.port}/', tmp_path / 'out', segments=4,
+                                min_segment_size=1024 * 1024)
+        try:
+            failures = client.download_all(client.list_files(), DownloadProgress())
+        finally:
+            client.close()
+    finally:
+        server.stop(timeout=0)
+
+    assert failures == []
+    assert [r for r in ranges if r is not None] == ['bytes=0-']
@@ -0,0 +1,77 @@
+import io
+import logging
+import os
+import zipfile
+
+import pytest
+
+from nullshare.archive import ArchiveChanged
+from nullshare.server import ShareServer
+
+logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+
+@pytest.fixture
+def shared_folder(tmp_path):
+    folder = tmp_path / 'share'
+    folder.mkdir()
+    (folder / 'a.txt').write_bytes(b'a' * 1000)
+    (folder / 'b.txt').write_bytes(b'b' * 1000)
+    return folder
+
+
+def _edit_in_place(path, data):
+    """Rewrite a file without touching its directory's mtime."""
+    parent = os.stat(path.parent)
+    path.write_bytes(data)
+    os.utime(path.parent, ns=(parent.st_atime_ns, parent.st_mtime_ns))
+
+
+def test_changed_folder_is_rescanned_after_a_failed_archive(shared_folder):
+    server = ShareServer([shared_folder], port=0)
+    client = server.app.test_client()
+    _edit_in_place(shared_folder / 'b.txt', b'changed')
+
+    with pytest.raises(ArchiveChanged):
+        client.get('/download/share.zip').get_data()
+
+    response = client.get('/download/share.zip')
+    with zipfile.ZipFile(io.BytesIO(response.get_data())) as archive:
+        assert archive.read('b.txt') == b'changed'
+
+
+def test_folder_archive_after_restart(shared_folder):
+    server = ShareServer([shared_folder], port=0, zip_workers=2)
+    client = server.app.test_client()
+    server.start()
+    server.stop(timeout=0)
+    server.start()
+    try:
+        response = client.get('/download/share.zip')
+        with zipfile.ZipFile(io.BytesIO(response.get_data())) as archive:
+            assert archive.read('a.txt') == b'a' * 1000
+    finally:
+        server.stop(timeout=0)
+
+
+def test_head_download_runs_close_callbacks_once(shared_folder):
+    server = ShareServer([shared_folder / 'a.txt'], port=0)
+    client = server.app.test_client()
+
+    response = client.head('/download/a.txt')
+    assert response.status_code == 200
+    assert response.headers['Content-Length'] == '1000'
+    assert response.get_data() == b''
+    response.close()
+
+    _, _, count = server.stats.request_duration.collect()
+    assert count == 1
+
+
+def test_qr_code_with_token_is_not_cached(shared_folder):
+    server = ShareServer([shared_folder], port=0, password='secret')
+    client = server.app.test_client()
+
+    response = client.get(f'/qr.svg?token={server.access_token}')
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == 'private, no-store'
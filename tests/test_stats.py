@@ -0,0 +1,15 @@
+import threading
+
+from nullshare.stats import SHARDS_PRUNE_AT, ShardedCounter
+
+
+def test_writes_retire_shards_of_finished_threads():
+    counter = ShardedCounter()
+    for _ in range(SHARDS_PRUNE_AT * 4):
+        thread = threading.Thread(target=counter.add)
+        thread.start()
+        thread.join()
+
+    # Never read, so only the write path can have pruned
+    assert len(counter._shards) < SHARDS_PRUNE_AT
+    assert counter.value == SHARDS_PRUNE_AT * 4